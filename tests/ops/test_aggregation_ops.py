@@ -1,8 +1,10 @@
 import numpy as np
 import pandas as pd
+import pyarrow as pa
 import pytest
 
 from trane.ops.aggregation_ops import (
+    AggregationOpBase,
     AvgAggregationOp,
     CountAggregationOp,
     FirstAggregationOp,
@@ -102,3 +104,89 @@ def test_agg_None():
         output = op(df)
         assert output in [None, 0]
         assert op.generate_description() is not None
+
+
+@pytest.mark.parametrize(
+    "dtype",
+    [("int64"), ("int64[pyarrow]"), ("float64[pyarrow]"), ("string[pyarrow]")],
+)
+def test_grouped_label_function(dtype):
+    df = pd.DataFrame(
+        {
+            "id": [1, 1, 2, 2, 2, 3, 1, 3],
+            "col": [3, 1, 2, 2, 5, 4, 1, 4],
+        },
+    )
+    df["col"] = df["col"].astype(dtype)
+    for agg_operation in get_aggregation_ops():
+        op = agg_operation("col")
+        if dtype == "string[pyarrow]" and agg_operation in [
+            SumAggregationOp,
+            AvgAggregationOp,
+        ]:
+            continue
+        expected = {
+            group_key: op.label_function(dataslice)
+            for group_key, dataslice in df.groupby("id")
+        }
+        output = op.grouped_label_function(df, [df["id"]])
+        assert output.index.names == ["id"]
+        assert output.to_dict() == expected
+
+
+def test_grouped_label_function_fallback(df):
+    # the base implementation calls label_function on every group
+    df["id"] = [1, 1, 2, 2, 2]
+    op = SumAggregationOp("col")
+    output = AggregationOpBase.grouped_label_function(op, df, ["id"])
+    assert output.to_dict() == {1: 3, 2: 12}
+    assert output.to_dict() == op.grouped_label_function(df, ["id"]).to_dict()
+
+
+@pytest.mark.parametrize(
+    "dtype",
+    [("int64"), ("float64"), ("int64[pyarrow]"), ("float64[pyarrow]")],
+)
+def test_sliding_label_function(dtype):
+    df = pd.DataFrame({"col": [3, 1, None, 2, 5, 4, 1, 4]})
+    if dtype.startswith("int"):
+        df["col"] = df["col"].fillna(0)
+    df["col"] = df["col"].astype(dtype)
+    lo = np.array([0, 0, 1, 2, 2, 5, 3])
+    hi = np.array([8, 1, 4, 3, 7, 5, 8])
+    for agg_operation in get_aggregation_ops():
+        op = agg_operation("col")
+        output = op.sliding_label_function(df, lo, hi)
+        for window, (window_lo, window_hi) in enumerate(zip(lo, hi)):
+            if window_lo == window_hi:
+                continue
+            expected = op.label_function(df.iloc[window_lo:window_hi])
+            if pd.isna(expected):
+                assert pd.isna(output[window])
+            else:
+                assert output[window] == pytest.approx(expected)
+
+
+@pytest.mark.parametrize("dtype", [("int64"), ("float64[pyarrow]")])
+def test_arrow_label_function(dtype):
+    df = pd.DataFrame(
+        {
+            "id": [1, 1, 2, 2, 2, 3, 1, 3],
+            "col": [3, 1, 2, 2, 5, 4, 1, 4],
+        },
+    )
+    df["col"] = df["col"].astype(dtype)
+    table = pa.Table.from_pandas(df)
+    for agg_operation in get_aggregation_ops():
+        op = agg_operation("col")
+        output = op.arrow_label_function(table, ["id"])
+        if output is None:
+            # no Arrow kernel, the engine falls back to pandas
+            assert agg_operation is MajorityAggregationOp
+            continue
+        expected = {
+            group_key: op.label_function(dataslice)
+            for group_key, dataslice in df.groupby("id")
+        }
+        actual = dict(zip(output["id"].to_pylist(), output["label"].to_pylist()))
+        assert actual == pytest.approx(expected)
@@ -1,4 +1,5 @@
 import pandas as pd
+import pyarrow as pa
 import pytest
 
 from trane.ops.filter_ops import (
@@ -62,3 +63,24 @@ def test_greater_filter_op(df):
     output = op(df)
     assert output["col"].tolist() == [4, 5]
     assert op.generate_description() == " with <col> greater than <3>"
+
+
+@pytest.mark.parametrize(
+    "op_class",
+    [AllFilterOp, EqFilterOp, NeqFilterOp, GreaterFilterOp, LessFilterOp],
+)
+def test_arrow_label_function(df, op_class):
+    op = op_class("col")
+    if op.required_parameters is not None:
+        op.set_parameters(threshold=3)
+    output = op.arrow_label_function(pa.Table.from_pandas(df))
+    assert output["col"].to_pylist() == op(df)["col"].tolist()
+
+
+def test_label_mask_missing_values():
+    df = pd.DataFrame({"col": pd.array([1, None, 3, 4], dtype="int64[pyarrow]")})
+    op = GreaterFilterOp("col")
+    op.set_parameters(threshold=2)
+    assert op.label_mask(df).tolist() == [False, False, True, True]
+    assert op(df)["col"].tolist() == [3, 4]
+    assert AllFilterOp("col").label_mask(df) is None
@@ -6,7 +6,13 @@ from trane.ops.aggregation_ops import (
     CountAggregationOp,
     MinAggregationOp,
 )
-from trane.ops.filter_ops import AllFilterOp, EqFilterOp, GreaterFilterOp, LessFilterOp
+from trane.ops.filter_ops import (
+    AllFilterOp,
+    EqFilterOp,
+    GreaterFilterOp,
+    LessFilterOp,
+    NeqFilterOp,
+)
 
 
 @pytest.fixture
@@ -75,3 +81,25 @@ def test_check_parameters():
     assert AllFilterOp("col").has_parameters_set() is True
     with pytest.raises(NotImplementedError):
         AllFilterOp("col").set_parameters()
+
+
+@pytest.mark.parametrize(
+    "filter_op,column,fraction,expected",
+    [
+        (GreaterFilterOp, "col", 0.5, 30),
+        (LessFilterOp, "col", 0.3, 30),
+        (EqFilterOp, "col2", 0.4, "blue"),
+        (NeqFilterOp, "col2", 0.7, "green"),
+    ],
+)
+def test_find_threshold_by_fraction_of_data_to_keep(
+    df,
+    filter_op,
+    column,
+    fraction,
+    expected,
+):
+    op = filter_op(column)
+    threshold = op.find_threshold_by_fraction_of_data_to_keep(fraction, df, column)
+    assert threshold == expected
+    assert op.threshold is None
@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from trane import SingleTableMetadata
+from trane.core.problem import Problem
+from trane.ops import (
+    ColumnSketch,
+    EqFilterOp,
+    FrequentItemsSketch,
+    GreaterFilterOp,
+    IdentityOp,
+    QuantileSketch,
+    SumAggregationOp,
+    sketch_columns,
+)
+
+
+def test_quantile_sketch():
+    values = np.random.default_rng(0).lognormal(size=100_000)
+    sketch = QuantileSketch(k=256)
+    for chunk in np.array_split(values, 7):
+        sketch.update(chunk)
+    merged = QuantileSketch(k=256)
+    for chunk in np.array_split(values, 4):
+        merged.merge(QuantileSketch(k=256).update(chunk))
+
+    q = np.linspace(0, 1, 11)
+    sorted_values = np.sort(values)
+    for s in [sketch, merged]:
+        assert s.count == len(values)
+        assert s.weighted_values()[1].sum() == len(values)
+        estimates = s.quantile(q)
+        assert estimates[0] == values.min()
+        assert estimates[-1] == values.max()
+        rank_error = np.searchsorted(sorted_values, estimates) / len(values) - q
+        assert np.abs(rank_error).max() < 0.02
+        assert sum(len(level) for level in s.levels) < 5000
+
+
+def test_quantile_sketch_exact_when_small():
+    series = pd.Series([3.0, 1.0, np.nan, 2.0, 10.0])
+    q = np.linspace(0, 1, 7)
+    sketch = QuantileSketch().update(series)
+    np.testing.assert_allclose(sketch.quantile(q), series.quantile(q).to_numpy())
+
+
+def test_frequent_items_sketch():
+    values = np.random.default_rng(0).zipf(1.5, 50_000)
+    sketch = FrequentItemsSketch(k=32)
+    for chunk in np.array_split(values, 2):
+        sketch.merge(FrequentItemsSketch(k=32).update(chunk))
+    assert len(sketch.counters) <= 32
+    expected = pd.Series(values).value_counts().index[:3].tolist()
+    assert sketch.most_frequent(3) == expected
+
+
+def test_recommended_thresholds_from_sketches():
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(
+        {
+            "id": rng.integers(0, 10, 200),
+            "time": pd.date_range("2023-01-01", periods=200, freq="h"),
+            "price": rng.uniform(0, 100, 200),
+            "card_type": rng.choice(["visa", "mastercard", "amex", "other"], 200),
+        },
+    )
+    metadata = SingleTableMetadata(
+        ml_types={
+            "id": "Integer",
+            "time": "Datetime",
+            "price": "Double",
+            "card_type": "Categorical",
+        },
+        primary_key="id",
+        time_index="time",
+    )
+    chunks = [df[i : i + 50] for i in range(0, len(df), 50)]
+    sketches = sketch_columns(chunks, ["price", "card_type"], k=1000)
+    assert isinstance(sketches["price"], ColumnSketch)
+    for filter_op in [GreaterFilterOp("price"), EqFilterOp("card_type")]:
+        problem = Problem(
+            metadata=metadata,
+            operations=[filter_op, IdentityOp(None), SumAggregationOp("price")],
+            entity_column="id",
+            window_size="2d",
+        )
+        # nothing is compacted, so the sketches are exact
+        assert problem.get_recommended_thresholds(
+            sketches=sketches,
+        ) == pytest.approx(problem.get_recommended_thresholds(df))
@@ -4,8 +4,9 @@ import numpy as np
 import pandas as pd
 import pytest
 
-from trane.ops import EqFilterOp, GreaterFilterOp
+from trane.ops import EqFilterOp, GreaterFilterOp, LessFilterOp, NeqFilterOp
 from trane.ops.threshold_functions import (
+    _find_threshold_by_filtering,
     entropy_of_series,
     find_threshold_to_maximize_uncertainty,
     get_k_most_frequent,
@@ -182,3 +183,31 @@ def test_regression():
         filter_op=filter_op,
     )
     assert np.isclose(result, 30.01, atol=1e-6)
+
+
+@pytest.mark.parametrize(
+    "filter_op",
+    [EqFilterOp, NeqFilterOp, GreaterFilterOp, LessFilterOp],
+)
+@pytest.mark.parametrize("problem_type", ["classification", "regression"])
+def test_threshold_matches_filtering(filter_op, problem_type):
+    df = pd.DataFrame(
+        {"price": [5.0, 1.0, np.nan, 3.0, 3.0, 8.0, 1.0, 2.0, np.nan, 13.0]},
+    )
+    for n_quantiles in [5, 10, 100]:
+        thresholds = df["price"].quantile(np.linspace(0, 1, n_quantiles)).unique()
+        expected = _find_threshold_by_filtering(
+            df,
+            "price",
+            problem_type,
+            filter_op("price"),
+            thresholds,
+        )
+        result = find_threshold_to_maximize_uncertainty(
+            df,
+            "price",
+            problem_type,
+            filter_op=filter_op("price"),
+            n_quantiles=n_quantiles,
+        )
+        assert result == expected
@@ -1,8 +1,17 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 import pandas as pd
+import pyarrow as pa
 import pytest
 
 from trane.core.utils import (
+    calculate_target_values,
     generate_data_slices,
+    generate_window_bins,
+    partition_entities,
+    partition_entities_by_load,
+    search_entity_times,
     set_dataframe_index,
 )
 from trane.metadata import SingleTableMetadata
@@ -24,6 +33,8 @@ def test_set_dataframe_index():
         ("2d", "2d", [["A", "B"], ["C", "D"], ["E", "F"], ["G", "H"]]),
         ("3d", "3d", [["A", "B", "C"], ["D", "E", "F"], ["G", "H"]]),
         ("3d", "3d", [["A", "B", "C"], ["D", "E", "F"], ["G", "H"]]),
+        ("3d", "2d", [["A", "B", "C"], ["C", "D", "E"], ["E", "F", "G"], ["G", "H"]]),
+        ("1d", "3d", [["A"], ["D"], ["G"]]),
     ],
 )
 def test_generate_data_slices(window_size, gap, expected_dataslices):
@@ -63,3 +74,351 @@ def test_create_mock_data_metadata():
         assert col in metadata.ml_types
     assert len(metadata.ml_types) == len(data.columns)
     assert data["transaction_id"].is_unique
+
+
+@pytest.mark.parametrize("window_size", ["1d", "2d", "3d"])
+def test_generate_window_bins(window_size):
+    df = pd.DataFrame(
+        {
+            "id": [1, 2, 1, 2, 1, 1, 2, 1],
+            "data": list("ABCDEFGH"),
+            "timestamp": pd.date_range(start="2022-01-01", end="2022-01-08", freq="D"),
+        },
+    )
+    df = set_dataframe_index(df, "timestamp")
+    bins = generate_window_bins(df, "id", window_size)
+    for _, df_by_id in df.assign(bin=bins).groupby("id"):
+        expected = [
+            dataslice["data"].tolist()
+            for dataslice, _ in generate_data_slices(
+                df=df_by_id,
+                window_size=window_size,
+                gap=window_size,
+            )
+        ]
+        actual = [
+            dataslice["data"].tolist() for _, dataslice in df_by_id.groupby("bin")
+        ]
+        assert actual == expected
+
+
+@pytest.mark.parametrize("engine", ["slices", "vectorized", "arrow"])
+def test_calculate_target_values_engine(engine):
+    df = pd.DataFrame(
+        {
+            "id": [1, 2, 1, 2, 1, 1, 2, 1],
+            "timestamp": pd.to_datetime(
+                [
+                    "2022-01-03 00:00",
+                    "2022-01-01 00:00",
+                    "2022-01-01 12:00",
+                    "2022-01-02 00:00",
+                    "2022-01-01 00:00",
+                    "2022-01-05 00:00",
+                    "2022-01-09 00:00",
+                    "2022-01-04 00:00",
+                ],
+            ),
+        },
+    )
+
+    def count(dataslice):
+        return len(dataslice)
+
+    lt = calculate_target_values(
+        df,
+        target_dataframe_index="id",
+        labeling_function=count,
+        time_index="timestamp",
+        window_size="2d",
+        engine=engine,
+    )
+    assert lt["id"].tolist() == [1, 1, 1, 2, 2]
+    assert (
+        lt["cutoff_time"].tolist()
+        == pd.to_datetime(
+            ["2022-01-01", "2022-01-03", "2022-01-05", "2022-01-01", "2022-01-09"],
+        ).tolist()
+    )
+    assert lt["count"].tolist() == [2, 2, 1, 2, 1]
+
+
+@pytest.mark.parametrize("engine", ["slices", "vectorized"])
+def test_calculate_target_values_sliding(engine):
+    df = pd.DataFrame(
+        {
+            "id": [1, 2, 1, 2, 1, 1, 2, 1],
+            "timestamp": pd.to_datetime(
+                [
+                    "2022-01-03 00:00",
+                    "2022-01-01 00:00",
+                    "2022-01-01 12:00",
+                    "2022-01-02 00:00",
+                    "2022-01-01 00:00",
+                    "2022-01-05 00:00",
+                    "2022-01-09 00:00",
+                    "2022-01-04 00:00",
+                ],
+            ),
+        },
+    )
+
+    def count(dataslice):
+        return len(dataslice)
+
+    lt = calculate_target_values(
+        df,
+        target_dataframe_index="id",
+        labeling_function=count,
+        time_index="timestamp",
+        window_size="2d",
+        engine=engine,
+        gap="1d",
+    )
+    # windows start every day from the first timestamp of each entity, the
+    # empty ones (2022-01-03 to 2022-01-07 for id 2) are dropped
+    assert lt["id"].tolist() == [1, 1, 1, 1, 1, 2, 2, 2, 2]
+    assert (
+        lt["cutoff_time"].tolist()
+        == pd.to_datetime(
+            [
+                "2022-01-01",
+                "2022-01-02",
+                "2022-01-03",
+                "2022-01-04",
+                "2022-01-05",
+                "2022-01-01",
+                "2022-01-02",
+                "2022-01-08",
+                "2022-01-09",
+            ],
+        ).tolist()
+    )
+    assert lt["count"].tolist() == [2, 1, 2, 2, 1, 2, 1, 1, 1]
+
+
+@pytest.mark.parametrize("gap", [None, "1d"])
+def test_calculate_target_values_dtypes(gap):
+    df = pd.DataFrame(
+        {
+            "id": pd.Categorical(["b", "a", "b", "a", "b", "b"]),
+            "amount": [1, 2, 3, 4, -5, -6],
+            "timestamp": pd.date_range("2022-01-01", periods=6, freq="17h", tz="UTC"),
+        },
+    )
+
+    def count_positive(dataslice):
+        return int((dataslice["amount"] > 0).sum())
+
+    def grouped_count_positive(df, by):
+        # windows without positive amounts are left out
+        return df[df["amount"] > 0].groupby(by, observed=True).size()
+
+    kwargs = dict(
+        target_dataframe_index="id",
+        labeling_function=count_positive,
+        time_index="timestamp",
+        window_size="2d",
+        gap=gap,
+    )
+    expected = calculate_target_values(df, engine="slices", **kwargs)
+    lt = calculate_target_values(
+        df,
+        engine="vectorized",
+        grouped_labeling_function=grouped_count_positive,
+        **kwargs,
+    )
+    pd.testing.assert_frame_equal(lt, expected)
+    assert lt["id"].dtype == object
+    assert lt["cutoff_time"].dtype == "datetime64[ns, UTC]"
+    assert lt["count_positive"].dtype == np.int64
+
+
+def test_search_entity_times():
+    entity_codes = np.array([0, 0, 0, 1, 1, 2])
+    timestamps = np.array([1, 3, 3, 2, 5, 0])
+    positions = search_entity_times(
+        entity_codes,
+        timestamps,
+        np.array([0, 0, 0, 1, 1, 2, -1, 3]),
+        np.array([3, 4, 0, 2, 9, 1, 5, 0]),
+    )
+    assert positions.tolist() == [1, 3, 0, 3, 5, 6, 0, 6]
+
+
+def test_calculate_target_values_cutoff_times():
+    df = pd.DataFrame(
+        {
+            "id": [1, 2, 1, 2, 1, 1, 2, 1],
+            "timestamp": pd.to_datetime(
+                [
+                    "2022-01-03 00:00",
+                    "2022-01-01 00:00",
+                    "2022-01-01 12:00",
+                    "2022-01-02 00:00",
+                    "2022-01-01 00:00",
+                    "2022-01-05 00:00",
+                    "2022-01-09 00:00",
+                    "2022-01-04 00:00",
+                ],
+            ),
+        },
+    )
+    cutoff_times = pd.DataFrame(
+        {
+            "id": [2, 1, 1, 3, 2],
+            "cutoff_time": pd.to_datetime(
+                [
+                    "2022-01-08 12:00",
+                    "2022-01-01 06:00",
+                    "2022-01-03 00:00",
+                    "2022-01-01 00:00",
+                    "2022-01-03 00:00",
+                ],
+            ),
+        },
+    )
+
+    def count(dataslice):
+        return len(dataslice)
+
+    lt = calculate_target_values(
+        df,
+        target_dataframe_index="id",
+        labeling_function=count,
+        time_index="timestamp",
+        window_size="2d",
+        cutoff_times=cutoff_times,
+    )
+    # one row per cutoff time, in order, empty windows included
+    assert lt["id"].tolist() == [2, 1, 1, 3, 2]
+    assert lt["cutoff_time"].tolist() == cutoff_times["cutoff_time"].tolist()
+    assert lt["count"].tolist() == [1, 2, 2, 0, 0]
+
+
+@pytest.mark.parametrize("output", ["columnar", "arrow"])
+def test_calculate_target_values_output(output):
+    df = pd.DataFrame(
+        {
+            "id": ["a", "b", "a", "b", "a"],
+            "timestamp": pd.to_datetime(
+                [
+                    "2022-01-01 00:00",
+                    "2022-01-01 00:00",
+                    "2022-01-02 00:00",
+                    "2022-01-05 00:00",
+                    "2022-01-06 00:00",
+                ],
+            ),
+        },
+    )
+
+    def count(dataslice):
+        return len(dataslice)
+
+    lt = calculate_target_values(
+        df,
+        target_dataframe_index="id",
+        labeling_function=count,
+        time_index="timestamp",
+        window_size="2d",
+        output=output,
+        label_dtype="int64[pyarrow]",
+    )
+    if output == "arrow":
+        assert lt.schema.field("id").type == pa.dictionary(pa.int8(), pa.string())
+        assert lt.schema.field("cutoff_time").type == pa.timestamp("ns")
+        assert lt.schema.field("count").type == pa.int64()
+        lt = lt.to_pandas()
+    else:
+        assert lt.dtypes.astype(str).tolist() == [
+            "category",
+            "datetime64[ns]",
+            "int64[pyarrow]",
+        ]
+    assert lt["id"].tolist() == ["a", "a", "b", "b"]
+    assert lt["count"].tolist() == [2, 1, 1, 1]
+
+
+def test_calculate_target_values_invalid_engine():
+    df = pd.DataFrame({"id": [1], "timestamp": pd.to_datetime(["2022-01-01"])})
+    with pytest.raises(ValueError):
+        calculate_target_values(df, "id", len, "timestamp", "1d", engine="spark")
+
+
+def test_partition_entities():
+    entities = pd.Series([1, 2, 3, 1, 2, 3, 4, 5, 6, 7] * 10)
+    partitions = partition_entities(entities, 4)
+    assert len(partitions) == len(entities)
+    assert set(partitions).issubset(range(4))
+    for _, partitions_by_entity in pd.Series(partitions).groupby(entities):
+        assert partitions_by_entity.nunique() == 1
+    assert (partition_entities(entities, 4) == partitions).all()
+
+
+def test_partition_entities_by_load():
+    # entity 0 owns half of the rows
+    entities = pd.Series([0] * 60 + list(range(1, 61)))
+    partitions, expected_rows = partition_entities_by_load(entities, 4)
+    assert expected_rows.tolist() == [60, 20, 20, 20]
+    for partition in range(4):
+        assert (partitions == partition).sum() == expected_rows[partition]
+    for _, partitions_by_entity in pd.Series(partitions).groupby(entities):
+        assert partitions_by_entity.nunique() == 1
+
+    # with windows, the heavy entity is split between partitions
+    window_bins = np.r_[np.arange(60) // 5, np.zeros(60, dtype=np.int64)]
+    partitions, expected_rows = partition_entities_by_load(
+        entities,
+        4,
+        window_bins=window_bins,
+    )
+    assert expected_rows.tolist() == [30, 30, 30, 30]
+    assert len(set(partitions[:60])) > 1
+    for _, partitions_by_window in pd.Series(partitions).groupby(
+        [entities, window_bins],
+    ):
+        assert partitions_by_window.nunique() == 1
+
+
+@pytest.mark.parametrize("engine", ["slices", "vectorized"])
+def test_calculate_target_values_balanced(engine):
+    df = pd.DataFrame(
+        {
+            "id": [0] * 90 + list(range(1, 31)),
+            "timestamp": pd.date_range("2022-01-01", periods=120, freq="6h"),
+        },
+    )
+
+    def count(dataslice):
+        return len(dataslice)
+
+    kwargs = dict(
+        target_dataframe_index="id",
+        labeling_function=count,
+        time_index="timestamp",
+        window_size="2d",
+        engine=engine,
+    )
+    expected = calculate_target_values(df, **kwargs)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        actual = calculate_target_values(
+            df,
+            executor=executor,
+            n_jobs=4,
+            partitioner="balanced",
+            **kwargs,
+        )
+    pd.testing.assert_frame_equal(actual, expected)
+    shards = pd.DataFrame(actual.attrs["shards"])
+    assert shards["rows"].sum() == len(df)
+    assert shards["windows"].sum() == len(expected)
+    assert (shards["expected_rows"] == shards["rows"]).all()
+    if engine == "vectorized":
+        # the heavy entity (90 rows) is split between the shards
+        assert shards["rows"].max() < 45
+    # derived frames copy the attrs, which must stay comparable
+    both = pd.concat([actual, actual], ignore_index=True)
+    assert len(both) == 2 * len(expected)
+    merged = actual.merge(actual, on=["id", "cutoff_time"])
+    assert len(merged) == len(expected)
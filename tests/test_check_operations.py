@@ -272,3 +272,16 @@ def test_generate_possible_operations(metadata):
         #     transform_op.__class__.__name__,
         #     agg_op.__class__.__name__,
         # }.intersection(agg_op.restricted_ops) == set()
+
+
+def test_generate_possible_operations_type_compatible(metadata):
+    possible_operations = _generate_possible_operations(
+        ml_types=metadata.ml_types,
+        primary_key=metadata.primary_key,
+        time_index=metadata.time_index,
+    )
+    keys = {(filter_op, agg_op) for filter_op, _, agg_op in possible_operations}
+    assert len(keys) == len(possible_operations)
+    for operations in possible_operations:
+        result, _ = _check_operations_valid(operations, metadata)
+        assert result is True
@@ -0,0 +1,103 @@
+import pandas as pd
+import pytest
+
+from trane.core.incremental import IncrementalTargetValues
+from trane.core.problem import Problem
+from trane.ops.aggregation_ops import (
+    AvgAggregationOp,
+    CountAggregationOp,
+    LastAggregationOp,
+)
+from trane.ops.filter_ops import AllFilterOp, GreaterFilterOp
+from trane.ops.transformation_ops import IdentityOp
+from trane.utils import create_mock_data, create_mock_data_metadata
+
+
+@pytest.fixture
+def data():
+    return create_mock_data(
+        return_single_dataframe=True,
+        num_customers=10,
+        num_sessions=100,
+        num_transactions=1000,
+    )
+
+
+@pytest.fixture
+def metadata():
+    return create_mock_data_metadata(single_table=True)
+
+
+@pytest.mark.parametrize(
+    "operations",
+    [
+        [AllFilterOp(None), IdentityOp(None), CountAggregationOp(None)],
+        [GreaterFilterOp("amount"), IdentityOp(None), AvgAggregationOp("amount")],
+        [AllFilterOp(None), IdentityOp(None), LastAggregationOp("brand")],
+    ],
+)
+@pytest.mark.parametrize("entity_column", ["customer_id", None])
+def test_incremental_target_values(data, metadata, operations, entity_column, tmp_path):
+    problem = Problem(
+        metadata=metadata,
+        operations=operations,
+        entity_column=entity_column,
+        window_size="1d",
+    )
+    if not problem.has_parameters_set():
+        problem.set_parameters(50.0)
+    expected = problem.create_target_values(data.copy(), engine="vectorized")
+
+    data = data.sort_values("transaction_time")
+    split_1, split_2 = int(len(data) * 0.6), int(len(data) * 0.8)
+    state = IncrementalTargetValues(problem, data[:split_1])
+    state.update(data[split_1:split_2])
+    pd.testing.assert_frame_equal(
+        state.target_values,
+        problem.create_target_values(data[:split_2].copy(), engine="vectorized"),
+    )
+    state.save(tmp_path / "state.pkl")
+    state = IncrementalTargetValues.load(tmp_path / "state.pkl")
+    updated = state.update(data[split_2:])
+
+    pd.testing.assert_frame_equal(state.target_values, expected)
+    # only windows of the entities with new rows are relabeled ...
+    new_rows = data[split_2:]
+    keys = ["cutoff_time"]
+    if entity_column is not None:
+        keys = [entity_column, "cutoff_time"]
+        assert updated[entity_column].isin(new_rows[entity_column]).all()
+    assert len(updated) < len(expected)
+    # ... their labels are those of a full recompute ...
+    pd.testing.assert_frame_equal(
+        updated.reset_index(drop=True),
+        updated[keys].merge(expected, on=keys, how="left"),
+        check_dtype=False,
+    )
+    # ... and every window a new row falls in is among them
+    new_rows = new_rows.rename(columns={"transaction_time": "cutoff_time"})[keys]
+    windows_of_new_rows = pd.merge_asof(
+        new_rows.astype(expected[keys].dtypes.to_dict()),
+        expected[keys]
+        .assign(window=expected["cutoff_time"])
+        .sort_values("cutoff_time"),
+        on="cutoff_time",
+        by=keys[:-1] or None,
+    )
+    windows_of_new_rows = windows_of_new_rows[keys[:-1] + ["window"]]
+    updated_windows = updated[keys].rename(columns={"cutoff_time": "window"})
+    assert len(windows_of_new_rows.merge(updated_windows)) == len(new_rows)
+
+
+def test_incremental_target_values_late_rows(data, metadata):
+    operations = [AllFilterOp(None), IdentityOp(None), CountAggregationOp(None)]
+    problem = Problem(
+        metadata,
+        operations,
+        entity_column="customer_id",
+        window_size="1d",
+    )
+    data = data.sort_values("transaction_time")
+    state = IncrementalTargetValues(problem, data[100:])
+    with pytest.raises(ValueError):
+        state.update(data[:100])
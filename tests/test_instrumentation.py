@@ -0,0 +1,116 @@
+import json
+import threading
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from trane import SingleTableMetadata
+from trane.core import profile
+from trane.core.instrumentation import span
+from trane.core.problem import Problem
+from trane.ops.aggregation_ops import SumAggregationOp
+from trane.ops.filter_ops import LessFilterOp
+from trane.ops.transformation_ops import IdentityOp
+
+
+@pytest.fixture()
+def problem():
+    metadata = SingleTableMetadata(
+        ml_types={
+            "building_id": "Integer",
+            "timestamp": "Datetime",
+            "meter_reading": "Double",
+        },
+        primary_key="building_id",
+        time_index="timestamp",
+    )
+    problem = Problem(
+        metadata=metadata,
+        operations=[
+            LessFilterOp("meter_reading"),
+            IdentityOp(None),
+            SumAggregationOp("meter_reading"),
+        ],
+        entity_column="building_id",
+        window_size="2d",
+    )
+    problem.set_parameters(50.0)
+    return problem
+
+
+@pytest.fixture()
+def df():
+    return pd.DataFrame(
+        {
+            "building_id": np.random.randint(0, 10, 100),
+            "timestamp": pd.date_range(start="2016-01-01", periods=100, freq="H"),
+            "meter_reading": np.random.uniform(0, 100, 100),
+        },
+    )
+
+
+def test_profile(tmp_path, problem, df):
+    with profile() as report:
+        lt = problem.create_target_values(df)
+    for name in ["groupby", "windowing", "label_function", "record_assembly"]:
+        assert report.spans[name]["calls"] > 0
+    assert report.counters["rows_in"] == len(df)
+    assert report.counters["windows"] == len(lt)
+    assert report.counters["LessFilterOp.rows_in"] == len(df)
+    assert report.counters["LessFilterOp.rows_out"] == (df["meter_reading"] < 50).sum()
+
+    path = tmp_path / "report.json"
+    report.to_json(path)
+    with open(path) as f:
+        assert json.load(f) == report.to_dict()
+
+    # nothing is recorded outside the block
+    problem.create_target_values(df)
+    assert report.counters["rows_in"] == len(df)
+
+
+def test_profile_memory(problem, df):
+    with profile() as report:
+        problem.create_target_values(df)
+    assert "peak_bytes" not in report.spans["label_function"]
+    assert "frames" not in report.to_dict()
+
+    with profile(memory=True) as report:
+        problem.create_target_values(df)
+    assert not tracemalloc.is_tracing()
+    for name in ["groupby", "windowing", "label_function", "record_assembly"]:
+        assert report.spans[name]["peak_bytes"] > 0
+        assert "retained_bytes" in report.spans[name]
+    assert report.frames["prepare"] > 0
+    assert report.frames["target_values"] > 0
+
+
+def test_profile_memory_threads():
+    allocated, b_entered, a_exited = (threading.Event() for _ in range(3))
+    kept = []
+
+    def a():
+        with span("a"):
+            kept.append(np.ones(2**20))
+            allocated.set()
+            b_entered.wait()
+        a_exited.set()
+
+    def b():
+        allocated.wait()
+        # b starts after a's allocation and ends after a, without allocating
+        with span("b"):
+            b_entered.set()
+            a_exited.wait()
+
+    with profile(memory=True) as report:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [executor.submit(a), executor.submit(b)]
+            for future in futures:
+                future.result()
+    assert report.spans["a"]["retained_bytes"] >= 8 * 2**20
+    assert report.spans["a"]["peak_bytes"] >= 8 * 2**20
+    assert report.spans["b"]["retained_bytes"] < 2**16
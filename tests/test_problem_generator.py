@@ -1,10 +1,14 @@
+from concurrent.futures import ThreadPoolExecutor
+
 import pandas as pd
 import pytest
 from tqdm import tqdm
 
 from trane.core.problem import Problem
 from trane.core.problem_generator import ProblemGenerator
+from trane.core.problem_set import ProblemSet
 from trane.metadata import MultiTableMetadata, SingleTableMetadata
+from trane.ops.aggregation_ops import SumAggregationOp
 from trane.utils.testing_utils import generate_mock_data
 
 
@@ -94,6 +98,161 @@ def test_problem_generator_multi(tables, target_table):
                 check_problem_type(labels, p.get_problem_type())
 
 
+def test_iter_problems():
+    def make_problem_generator():
+        _, ml_types, _, _, time_index = generate_mock_data(tables=["products"])
+        metadata = SingleTableMetadata(
+            ml_types=ml_types,
+            primary_key="id",
+            time_index=time_index,
+        )
+        return ProblemGenerator(metadata=metadata, window_size="2d")
+
+    problems = make_problem_generator().generate(verbose=False)
+
+    iterator = make_problem_generator().iter_problems()
+    first = next(iterator)
+    assert first.is_valid()
+    lazy = [first, *iterator]
+    assert [str(p) for p in lazy] == [
+        str(p) for p in make_problem_generator().iter_problems()
+    ]
+    assert sorted(str(p) for p in lazy) == [str(p) for p in problems]
+
+
+def test_generate_leaves_metadata_unchanged():
+    _, ml_types, _, _, time_index = generate_mock_data(tables=["products"])
+    metadata = SingleTableMetadata(
+        ml_types=ml_types,
+        primary_key="id",
+        time_index=time_index,
+    )
+    original_ml_types = {
+        column: (type(ml_type), ml_type.get_tags())
+        for column, ml_type in metadata.ml_types.items()
+    }
+    problem_generator = ProblemGenerator(metadata=metadata, window_size="2d")
+    problems = problem_generator.generate(verbose=False)
+    assert {
+        column: (type(ml_type), ml_type.get_tags())
+        for column, ml_type in metadata.ml_types.items()
+    } == original_ml_types
+    again = problem_generator.generate(verbose=False)
+    assert [str(p) for p in again] == [str(p) for p in problems]
+
+
+@pytest.mark.parametrize("target_table", ["logs", ["logs", "sessions"]])
+def test_generate_parallel(target_table):
+    _, ml_types, relationships, primary_keys, time_indices = generate_mock_data(
+        tables=["products", "logs", "sessions"],
+    )
+    metadata = MultiTableMetadata(
+        ml_types=ml_types,
+        primary_keys=primary_keys,
+        relationships=relationships,
+        time_indices=time_indices,
+    )
+    problem_generator = ProblemGenerator(
+        metadata=metadata,
+        window_size="2d",
+        target_table=target_table,
+    )
+    expected = problem_generator.generate(verbose=False)
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        actual = problem_generator.generate(verbose=False, executor=executor)
+    assert [(str(p), p.target_table) for p in actual] == [
+        (str(p), p.target_table) for p in expected
+    ]
+    actual = problem_generator.generate(verbose=False, n_jobs=2)
+    assert [str(p) for p in actual] == [str(p) for p in expected]
+
+
+def test_generate_problem_set():
+    _, ml_types, _, _, time_index = generate_mock_data(tables=["products"])
+    metadata = SingleTableMetadata(
+        ml_types=ml_types,
+        primary_key="id",
+        time_index=time_index,
+    )
+    problem_generator = ProblemGenerator(metadata=metadata, window_size="2d")
+    problems = problem_generator.generate(verbose=False)
+    problem_set = problem_generator.generate_problem_set(verbose=False)
+    assert isinstance(problem_set, ProblemSet)
+    assert len(problem_set) == len(problems)
+    assert list(problem_set.descriptions) == [str(p) for p in problems]
+    assert [str(p) for p in problem_set] == [str(p) for p in problems]
+    assert problem_set[0].operations == problems[0].operations
+    assert problem_set.count_problem_types() == {
+        "classification": sum(p.is_classification() for p in problems),
+        "regression": sum(p.is_regression() for p in problems),
+    }
+
+    sums = problem_set.filter(problem_set.aggregation_ops == "SumAggregationOp")
+    assert len(sums) > 0
+    assert all(isinstance(p.operations[2], SumAggregationOp) for p in sums)
+    assert list(sums[::-1].sort().descriptions) == list(sums.descriptions)
+
+    problem = next(p for p in problems if not p.has_parameters_set())
+    problem.set_parameters(1.0)
+    from_problems = ProblemSet.from_problems(problems)
+    assert [str(p) for p in from_problems] == [str(p) for p in problems]
+    assert all(p.has_parameters_set() for p in from_problems if str(p) == str(problem))
+
+
+def test_problem_keys():
+    _, ml_types, _, _, time_index = generate_mock_data(tables=["products"])
+    metadata = SingleTableMetadata(
+        ml_types=ml_types,
+        primary_key="id",
+        time_index=time_index,
+    )
+    problems = ProblemGenerator(metadata=metadata, window_size="2d").generate(
+        verbose=False,
+    )
+    assert len(set(problems)) == len(problems)
+    problem_set = ProblemGenerator(
+        metadata=metadata,
+        window_size="48h",
+    ).generate_problem_set(verbose=False)
+    assert problem_set.keys() == [p.get_key() for p in problems]
+    assert set(problem_set) == set(problems)
+    assert {p.get_key(): p for p in problems}[problem_set[3].get_key()] == problems[3]
+
+    problem = next(p for p in problem_set if not p.has_parameters_set())
+    other = next(p for p in problem_set if str(p) == str(problem))
+    problem.set_parameters(1.0)
+    assert problem != other
+    other.set_parameters(1.0)
+    assert problem == other
+    assert hash(problem) == hash(other)
+
+
+def test_generated_problems_do_not_share_operations():
+    _, ml_types, _, _, time_index = generate_mock_data(tables=["products"])
+    metadata = SingleTableMetadata(
+        ml_types=ml_types,
+        primary_key="id",
+        time_index=time_index,
+    )
+    problem_generator = ProblemGenerator(metadata=metadata, window_size="2d")
+    for problems in [
+        problem_generator.generate(verbose=False),
+        list(problem_generator.iter_problems()),
+    ]:
+        # the same operations generated for another entity column
+        problem = next(p for p in problems if not p.has_parameters_set())
+        others = [
+            p
+            for p in problems
+            if p is not problem and p.get_key()[0] == problem.get_key()[0]
+        ]
+        assert len(others) > 0
+        problem_set = set(others)
+        problem.set_parameters(0.5)
+        assert all(not p.has_parameters_set() for p in others)
+        assert all(p in problem_set for p in others)
+
+
 def check_problem_type(labels, problem_type):
     if "target" not in labels.columns:
         return None
@@ -0,0 +1,130 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pytest
+
+from trane.core.problem import Problem, create_batch_target_values
+from trane.core.sink import ParquetSink
+from trane.ops.aggregation_ops import CountAggregationOp, SumAggregationOp
+from trane.ops.filter_ops import AllFilterOp
+from trane.ops.transformation_ops import IdentityOp
+from trane.utils import create_mock_data, create_mock_data_metadata
+
+
+@pytest.fixture()
+def data():
+    return create_mock_data(return_single_dataframe=True, num_transactions=200)
+
+
+@pytest.fixture()
+def metadata():
+    return create_mock_data_metadata(single_table=True)
+
+
+@pytest.mark.parametrize("partitioning", ["entity_hash", "cutoff_month"])
+def test_parquet_sink(data, metadata, tmp_path, partitioning):
+    problem = Problem(
+        metadata=metadata,
+        operations=[AllFilterOp(None), IdentityOp(None), SumAggregationOp("amount")],
+        entity_column="customer_id",
+        window_size="2d",
+    )
+    expected = problem.create_target_values(data.copy(), output="columnar")
+    sink = ParquetSink(tmp_path / "labels", partitioning=partitioning, batch_rows=30)
+    target_values = problem.create_target_values(data.copy(), sink=sink)
+    assert len(target_values) == len(expected)
+    assert os.listdir(tmp_path / "labels")[0].startswith(f"{partitioning}=")
+
+    actual = target_values.to_pandas()
+    assert actual.columns.tolist() == ["customer_id", "cutoff_time", "target"]
+    actual = actual.sort_values(["customer_id", "cutoff_time"], ignore_index=True)
+    assert actual["customer_id"].tolist() == expected["customer_id"].tolist()
+    assert actual["cutoff_time"].tolist() == expected["cutoff_time"].tolist()
+    assert actual["target"].tolist() == pytest.approx(expected["target"].tolist())
+
+
+def test_parquet_sink_batch(data, metadata, tmp_path):
+    problems = [
+        Problem(
+            metadata=metadata,
+            operations=[AllFilterOp(None), IdentityOp(None), aggregation],
+            entity_column=None,
+            window_size="2d",
+        )
+        for aggregation in [CountAggregationOp(None), SumAggregationOp("amount")]
+    ]
+    expected = create_batch_target_values(problems, data.copy())
+    target_values = create_batch_target_values(
+        problems,
+        data.copy(),
+        sink=ParquetSink(tmp_path, partitioning="cutoff_month"),
+    )
+    actual = target_values.to_pandas().sort_values("cutoff_time", ignore_index=True)
+    # the identity column used to label without an entity isn't written
+    assert actual.columns.tolist() == expected.columns.tolist()
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+
+
+def test_parquet_sink_invalid_partitioning(tmp_path):
+    with pytest.raises(ValueError):
+        ParquetSink(tmp_path, partitioning="day")
+
+
+def test_parquet_sink_cutoff_times(data, metadata, tmp_path):
+    problem = Problem(
+        metadata=metadata,
+        operations=[AllFilterOp(None), IdentityOp(None), CountAggregationOp(None)],
+        entity_column="customer_id",
+        window_size="2d",
+    )
+    cutoff_times = pd.DataFrame(
+        {
+            # the last customer has no rows in the data
+            "customer_id": [1, 2, 3, 1000],
+            "cutoff_time": pd.to_datetime(["2021-01-01"] * 4),
+        },
+    )
+    expected = problem.create_target_values(
+        data.copy(),
+        cutoff_times=cutoff_times,
+        output="columnar",
+    )
+    target_values = problem.create_target_values(
+        data.copy(),
+        cutoff_times=cutoff_times,
+        sink=ParquetSink(tmp_path, batch_rows=30),
+    )
+    assert len(target_values) == len(cutoff_times)
+    actual = target_values.to_pandas().sort_values("customer_id", ignore_index=True)
+    assert actual["customer_id"].tolist() == expected["customer_id"].tolist()
+    assert actual["target"].tolist() == expected["target"].tolist()
+
+
+def test_parquet_sink_parallel(data, metadata, tmp_path, monkeypatch):
+    pools = []
+
+    class CountingExecutor(ThreadPoolExecutor):
+        def __init__(self, max_workers=None):
+            super().__init__(max_workers=max_workers)
+            pools.append(self)
+
+    monkeypatch.setattr("trane.core.utils.ProcessPoolExecutor", CountingExecutor)
+    problem = Problem(
+        metadata=metadata,
+        operations=[AllFilterOp(None), IdentityOp(None), SumAggregationOp("amount")],
+        entity_column="customer_id",
+        window_size="2d",
+    )
+    expected = problem.create_target_values(data.copy(), output="columnar")
+    target_values = problem.create_target_values(
+        data.copy(),
+        n_jobs=2,
+        sink=ParquetSink(tmp_path, batch_rows=30),
+    )
+    # every batch is labeled by the same pool
+    assert len(pools) == 1
+    actual = target_values.to_pandas()
+    actual = actual.sort_values(["customer_id", "cutoff_time"], ignore_index=True)
+    assert actual["cutoff_time"].tolist() == expected["cutoff_time"].tolist()
+    assert actual["target"].tolist() == pytest.approx(expected["target"].tolist())
@@ -1,12 +1,35 @@
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 import pandas as pd
 import pytest
 
 from trane import SingleTableMetadata
-from trane.core.problem import Problem
-from trane.ops.aggregation_ops import ExistsAggregationOp
-from trane.ops.filter_ops import AllFilterOp, GreaterFilterOp
-from trane.ops.transformation_ops import IdentityOp
+from trane.core.problem import (
+    Problem,
+    create_batch_target_values,
+    recommend_thresholds,
+)
+from trane.ops.aggregation_ops import (
+    AggregationOpBase,
+    CountAggregationOp,
+    ExistsAggregationOp,
+    LastAggregationOp,
+    MajorityAggregationOp,
+    SumAggregationOp,
+)
+from trane.ops.filter_ops import (
+    AllFilterOp,
+    EqFilterOp,
+    FilterOpBase,
+    GreaterFilterOp,
+    LessFilterOp,
+)
+from trane.ops.transformation_ops import (
+    IdentityOp,
+    OrderByOp,
+    TransformationOpBase,
+)
 
 
 @pytest.fixture()
@@ -60,3 +83,470 @@ def test_exists(data, metadata):
         window_size="2d",
     )
     problem.create_target_values(data)
+
+
+@pytest.mark.parametrize(
+    "operations",
+    [
+        [GreaterFilterOp("meter_reading"), IdentityOp(None), ExistsAggregationOp(None)],
+        [AllFilterOp(None), IdentityOp(None), CountAggregationOp(None)],
+        [
+            LessFilterOp("meter_reading"),
+            IdentityOp(None),
+            SumAggregationOp("meter_reading"),
+        ],
+        [
+            AllFilterOp(None),
+            OrderByOp("meter_reading"),
+            LastAggregationOp("building_id"),
+        ],
+    ],
+)
+def test_vectorized_engine_matches_slices(data, metadata, operations):
+    problem = Problem(
+        metadata=metadata,
+        operations=operations,
+        entity_column="building_id",
+        window_size="2d",
+    )
+    if not problem.has_parameters_set():
+        problem.set_parameters(50.0)
+    expected = problem.create_target_values(data.copy())
+    actual = problem.create_target_values(data.copy(), engine="vectorized")
+    pd.testing.assert_frame_equal(actual, expected)
+
+
+@pytest.mark.parametrize("threshold", [50.0, 1000.0])
+@pytest.mark.parametrize("dtype", ["float64", "float64[pyarrow]", "int64[pyarrow]"])
+def test_vectorized_engine_matches_slices_dtypes(data, metadata, threshold, dtype):
+    problem = Problem(
+        metadata=metadata,
+        operations=[
+            GreaterFilterOp("meter_reading"),
+            IdentityOp(None),
+            SumAggregationOp("meter_reading"),
+        ],
+        entity_column="building_id",
+        window_size="2d",
+    )
+    # the filter leaves some windows, or all of them, without rows
+    problem.set_parameters(threshold)
+    data = data.round().astype({"meter_reading": dtype})
+    expected = problem.create_target_values(data.copy())
+    actual = problem.create_target_values(data.copy(), engine="vectorized")
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=True)
+
+
+@pytest.mark.parametrize(
+    "operations",
+    [
+        [AllFilterOp(None), IdentityOp(None), CountAggregationOp(None)],
+        [
+            LessFilterOp("meter_reading"),
+            IdentityOp(None),
+            SumAggregationOp("meter_reading"),
+        ],
+        [
+            AllFilterOp(None),
+            OrderByOp("meter_reading"),
+            LastAggregationOp("building_id"),
+        ],
+    ],
+)
+def test_sliding_windows_match_slices(data, metadata, operations):
+    problem = Problem(
+        metadata=metadata,
+        operations=operations,
+        entity_column="building_id",
+        window_size="2d",
+    )
+    if not problem.has_parameters_set():
+        problem.set_parameters(50.0)
+    expected = problem.create_target_values(data.copy(), gap="12h")
+    actual = problem.create_target_values(data.copy(), engine="vectorized", gap="12h")
+    pd.testing.assert_frame_equal(actual, expected)
+
+
+@pytest.mark.parametrize("engine", ["slices", "vectorized"])
+def test_custom_operations(data, metadata, engine):
+    # defined here, as the op registries list every subclass once it's imported
+    class HighReadingFilterOp(FilterOpBase):
+        input_output_types = [("None", "None")]
+        description = " with a high reading"
+        required_parameters = None
+
+        def label_function(self, dataslice):
+            return dataslice[dataslice["meter_reading"] > 50]
+
+    class DoubleReadingOp(TransformationOpBase):
+        input_output_types = [("None", "None")]
+        description = " doubled"
+
+        def label_function(self, dataslice):
+            return dataslice.assign(doubled=dataslice["meter_reading"] * 2)
+
+    problem = Problem(
+        metadata=metadata,
+        operations=[
+            HighReadingFilterOp(None),
+            DoubleReadingOp(None),
+            SumAggregationOp("doubled"),
+        ],
+        entity_column="building_id",
+        window_size="2d",
+    )
+    expected = Problem(
+        metadata=metadata,
+        operations=[
+            GreaterFilterOp("meter_reading"),
+            IdentityOp(None),
+            SumAggregationOp("meter_reading"),
+        ],
+        entity_column="building_id",
+        window_size="2d",
+    )
+    expected.set_parameters(50.0)
+    expected = expected.create_target_values(data.copy(), engine=engine)
+    expected["target"] = expected["target"] * 2
+    actual = problem.create_target_values(data.copy(), engine=engine)
+    pd.testing.assert_frame_equal(actual, expected)
+
+
+@pytest.mark.parametrize("entity_column", ["building_id", None])
+def test_cutoff_times(data, metadata, entity_column):
+    operations = [
+        LessFilterOp("meter_reading"),
+        IdentityOp(None),
+        SumAggregationOp("meter_reading"),
+    ]
+    problem = Problem(
+        metadata=metadata,
+        operations=operations,
+        entity_column=entity_column,
+        window_size="2d",
+    )
+    problem.set_parameters(50.0)
+    expected = problem.create_target_values(data.copy())
+    cutoff_times = expected.drop(columns="target").iloc[::-1]
+    actual = problem.create_target_values(data.copy(), cutoff_times=cutoff_times)
+    pd.testing.assert_frame_equal(actual, expected.iloc[::-1].reset_index(drop=True))
+
+
+@pytest.mark.parametrize("engine", ["slices", "vectorized"])
+def test_cutoff_times_without_rows(data, metadata, engine):
+    problem = Problem(
+        metadata=metadata,
+        operations=[AllFilterOp(None), IdentityOp(None), CountAggregationOp(None)],
+        entity_column="building_id",
+        window_size="2d",
+    )
+    cutoff_times = pd.DataFrame(
+        {
+            "building_id": [100, 101],
+            "cutoff_time": pd.to_datetime(["2016-01-01", "2016-01-02"]),
+        },
+    )
+    # no rows are left once the instances are selected
+    lt = problem.create_target_values(
+        data.copy(),
+        instance_ids=[100],
+        cutoff_times=cutoff_times,
+        engine=engine,
+    )
+    assert lt["building_id"].tolist() == [100, 101]
+    assert lt["target"].tolist() == [0, 0]
+
+
+@pytest.mark.parametrize(
+    "operations",
+    [
+        [GreaterFilterOp("meter_reading"), IdentityOp(None), ExistsAggregationOp(None)],
+        [
+            LessFilterOp("meter_reading"),
+            IdentityOp(None),
+            SumAggregationOp("meter_reading"),
+        ],
+        [
+            AllFilterOp(None),
+            OrderByOp("meter_reading"),
+            LastAggregationOp("building_id"),
+        ],
+    ],
+)
+def test_arrow_engine(data, metadata, operations):
+    problem = Problem(
+        metadata=metadata,
+        operations=operations,
+        entity_column="building_id",
+        window_size="2d",
+    )
+    if not problem.has_parameters_set():
+        problem.set_parameters(50.0)
+    expected = problem.create_target_values(data.copy(), engine="vectorized")
+    actual = problem.create_target_values(
+        data.astype({"meter_reading": "float64[pyarrow]"}),
+        engine="arrow",
+    )
+    if isinstance(operations[1], IdentityOp):
+        # labeled in Arrow, so the columns stay Arrow-backed
+        assert all(isinstance(dtype, pd.ArrowDtype) for dtype in actual.dtypes)
+    pd.testing.assert_frame_equal(actual.astype(expected.dtypes.to_dict()), expected)
+
+
+def test_typed_output(data, metadata):
+    operations = [
+        LessFilterOp("meter_reading"),
+        IdentityOp(None),
+        SumAggregationOp("meter_reading"),
+    ]
+    problem = Problem(
+        metadata=metadata,
+        operations=operations,
+        entity_column="building_id",
+        window_size="2d",
+    )
+    problem.set_parameters(50.0)
+    assert problem.get_label_dtype(data) == "float64[pyarrow]"
+    expected = problem.create_target_values(data.copy())
+    lt = problem.create_target_values(data.copy(), output="columnar")
+    assert lt["building_id"].dtype == "category"
+    assert lt["target"].dtype == "float64[pyarrow]"
+    pd.testing.assert_frame_equal(lt.astype(expected.dtypes.to_dict()), expected)
+    table = problem.create_target_values(data.copy(), output="arrow")
+    assert table.column_names == ["building_id", "cutoff_time", "target"]
+    assert table.to_pandas().astype(expected.dtypes.to_dict()).equals(expected)
+
+
+def test_typed_output_majority(data):
+    data["level"] = pd.Categorical(np.random.randint(0, 3, len(data)))
+    metadata = SingleTableMetadata(
+        ml_types={
+            "building_id": "Integer",
+            "timestamp": "Datetime",
+            "meter_reading": "Double",
+            "level": "Categorical",
+        },
+        primary_key="building_id",
+        time_index="timestamp",
+    )
+    problem = Problem(
+        metadata=metadata,
+        operations=[
+            AllFilterOp(None),
+            IdentityOp(None),
+            MajorityAggregationOp("level"),
+        ],
+        entity_column="building_id",
+        window_size="2d",
+    )
+    # the majority of a categorical column is given as a string
+    assert problem.get_label_dtype(data) == "string[pyarrow]"
+    expected = problem.create_target_values(data.copy())["target"].tolist()
+    assert all(isinstance(value, str) for value in expected)
+    lt = problem.create_target_values(data.copy(), output="columnar")
+    assert lt["target"].tolist() == expected
+    table = problem.create_target_values(data.copy(), output="arrow")
+    assert table["target"].to_pylist() == expected
+
+
+def test_untyped_aggregation(data, metadata):
+    class RowCountOp(AggregationOpBase):
+        input_output_types = [("None", "None")]
+        description = " the number of rows"
+
+        def label_function(self, dataslice):
+            return len(dataslice)
+
+    problem = Problem(
+        metadata=metadata,
+        operations=[AllFilterOp(None), IdentityOp(None), RowCountOp(None)],
+        entity_column="building_id",
+        window_size="2d",
+    )
+    assert problem.get_label_dtype(data) is None
+    lt = problem.create_target_values(data.copy(), engine="slices")
+    assert lt["target"].sum() == len(data)
+
+
+def test_create_batch_target_values(data, metadata):
+    problems = []
+    for operations in [
+        [GreaterFilterOp("meter_reading"), IdentityOp(None), ExistsAggregationOp(None)],
+        [AllFilterOp(None), IdentityOp(None), CountAggregationOp(None)],
+        [AllFilterOp(None), IdentityOp(None), SumAggregationOp("meter_reading")],
+    ]:
+        problem = Problem(
+            metadata=metadata,
+            operations=operations,
+            entity_column="building_id",
+            window_size="2d",
+        )
+        problems.append(problem)
+    problems[0].set_parameters(50.0)
+
+    lt = create_batch_target_values(problems, data.copy())
+    assert lt.columns.tolist() == [
+        "building_id",
+        "cutoff_time",
+        *[str(problem) for problem in problems],
+    ]
+    for problem in problems:
+        expected = problem.create_target_values(data.copy())
+        actual = lt[["building_id", "cutoff_time", str(problem)]]
+        actual = actual.rename(columns={str(problem): "target"})
+        pd.testing.assert_frame_equal(actual, expected)
+
+
+def test_create_batch_target_values_parameters_set(data):
+    # thresholds can't be recommended for float categories, but are given
+    data["reading_level"] = np.random.choice([0.5, 1.5, 2.5], len(data))
+    metadata = SingleTableMetadata(
+        ml_types={
+            "building_id": "Integer",
+            "timestamp": "Datetime",
+            "meter_reading": "Double",
+            "reading_level": "Categorical",
+        },
+        primary_key="building_id",
+        time_index="timestamp",
+    )
+    problem = Problem(
+        metadata=metadata,
+        operations=[
+            EqFilterOp("reading_level"),
+            IdentityOp(None),
+            CountAggregationOp(None),
+        ],
+        entity_column="building_id",
+        window_size="2d",
+    )
+    problem.set_parameters(1.5)
+    lt = create_batch_target_values([problem], data.copy())
+    actual = lt.rename(columns={str(problem): "target"})
+    pd.testing.assert_frame_equal(actual, problem.create_target_values(data.copy()))
+    assert problem.operations[0].threshold == 1.5
+
+
+def test_create_batch_target_values_invalid(data, metadata):
+    operations = [AllFilterOp(None), IdentityOp(None), CountAggregationOp(None)]
+    problems = [
+        Problem(metadata, operations, entity_column="building_id", window_size="2d"),
+        Problem(metadata, operations, entity_column="building_id", window_size="1d"),
+    ]
+    with pytest.raises(ValueError):
+        create_batch_target_values(problems, data)
+    with pytest.raises(ValueError):
+        create_batch_target_values([problems[0], problems[0]], data)
+
+
+@pytest.mark.parametrize("engine", ["slices", "vectorized"])
+def test_parallel_target_values(data, metadata, engine):
+    operations = [
+        AllFilterOp(None),
+        IdentityOp(None),
+        SumAggregationOp("meter_reading"),
+    ]
+    problem = Problem(
+        metadata=metadata,
+        operations=operations,
+        entity_column="building_id",
+        window_size="2d",
+    )
+    expected = problem.create_target_values(data.copy(), engine=engine)
+    actual = problem.create_target_values(data.copy(), engine=engine, n_jobs=2)
+    pd.testing.assert_frame_equal(actual, expected)
+    actual = problem.create_target_values(
+        data.copy(),
+        engine=engine,
+        n_jobs=2,
+        transport="memory_map",
+    )
+    pd.testing.assert_frame_equal(actual, expected)
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        actual = problem.create_target_values(
+            data.copy(),
+            engine=engine,
+            executor=executor,
+        )
+    pd.testing.assert_frame_equal(actual, expected)
+
+
+@pytest.mark.parametrize("chunksize", [1, 7, 30, 1000])
+@pytest.mark.parametrize("entity_column", ["building_id", None])
+def test_iter_target_values(data, metadata, chunksize, entity_column):
+    operations = [
+        GreaterFilterOp("meter_reading"),
+        IdentityOp(None),
+        CountAggregationOp(None),
+    ]
+    problem = Problem(
+        metadata=metadata,
+        operations=operations,
+        entity_column=entity_column,
+        window_size="2d",
+    )
+    problem.set_parameters(50.0)
+    expected = problem.create_target_values(data.copy())
+
+    # chunks must be clustered by entity and sorted by time
+    if entity_column is not None:
+        data = data.sort_values(["building_id", "timestamp"])
+    chunks = [data[i : i + chunksize] for i in range(0, len(data), chunksize)]
+    actual = pd.concat(problem.iter_target_values(chunks), ignore_index=True)
+    if entity_column is not None:
+        actual = actual.sort_values(["building_id", "cutoff_time"], ignore_index=True)
+    pd.testing.assert_frame_equal(actual, expected)
+
+
+def test_iter_target_values_requires_parameters(data, metadata):
+    operations = [
+        GreaterFilterOp("meter_reading"),
+        IdentityOp(None),
+        CountAggregationOp(None),
+    ]
+    problem = Problem(
+        metadata,
+        operations,
+        entity_column="building_id",
+        window_size="2d",
+    )
+    with pytest.raises(ValueError):
+        next(problem.iter_target_values([data]))
+
+
+def test_recommend_thresholds(data, metadata):
+    problems = [
+        Problem(
+            metadata=metadata,
+            operations=operations,
+            entity_column="building_id",
+            window_size="2d",
+        )
+        for operations in [
+            [
+                GreaterFilterOp("meter_reading"),
+                IdentityOp(None),
+                CountAggregationOp(None),
+            ],
+            [
+                GreaterFilterOp("meter_reading"),
+                IdentityOp(None),
+                ExistsAggregationOp(None),
+            ],
+            [LessFilterOp("meter_reading"), IdentityOp(None), CountAggregationOp(None)],
+            [AllFilterOp(None), IdentityOp(None), CountAggregationOp(None)],
+        ]
+    ]
+    expected = [
+        problem.get_recommended_thresholds(data) if i < 3 else []
+        for i, problem in enumerate(problems)
+    ]
+    thresholds = recommend_thresholds(problems, data)
+    assert thresholds == expected
+    for problem, threshold in zip(problems[:3], thresholds):
+        assert problem.operations[0].threshold == threshold[-1]
+
+    # parameters already set are kept
+    problems[0].set_parameters(1.0)
+    recommend_thresholds(problems, data)
+    assert problems[0].operations[0].threshold == 1.0
@@ -0,0 +1,63 @@
+import multiprocessing
+import os
+import pickle
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from trane.core.transport import SharedDataFrame
+from trane.utils import create_mock_data
+
+
+def test_shared_dataframe():
+    df = create_mock_data(return_single_dataframe=True)
+    df = df.set_index("transaction_time")
+    df["device"] = df["device"].astype("string[pyarrow]")
+    with SharedDataFrame(df) as shared_df:
+        assert os.path.exists(shared_df.path)
+        # only the handle is pickled, not the data
+        assert len(pickle.dumps(shared_df)) < 2048
+        attached = pickle.loads(pickle.dumps(shared_df)).attach()
+        pd.testing.assert_frame_equal(attached, df)
+    assert not os.path.exists(shared_df.path)
+
+
+def _attach_peak_bytes(shared_df, positions):
+    # Arrow allocates from its own pool, numpy and Python are traced
+    tracemalloc.start()
+    try:
+        shard = shared_df.attach(positions)
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return len(shard), peak_bytes + pa.default_memory_pool().max_memory()
+
+
+def test_shared_dataframe_attach_copies_only_the_shard():
+    n_rows = 1_000_000
+    df = pd.DataFrame(
+        {
+            "id": np.arange(n_rows) % 100,
+            "amount": np.random.default_rng(0).random(n_rows),
+            "time": pd.date_range("2020-01-01", periods=n_rows, freq="min"),
+        },
+    ).set_index("time")
+    positions = np.arange(0, n_rows, 20)
+    with SharedDataFrame(df) as shared_df:
+        pd.testing.assert_frame_equal(shared_df.attach(positions), df.iloc[positions])
+        # a fresh worker process, so the pool's peak only counts the attach
+        with ProcessPoolExecutor(
+            max_workers=1,
+            mp_context=multiprocessing.get_context("spawn"),
+        ) as executor:
+            n_shard_rows, peak_bytes = executor.submit(
+                _attach_peak_bytes,
+                shared_df,
+                positions,
+            ).result()
+    assert n_shard_rows == len(positions)
+    # a copy of the whole dataframe would be 24MB, the shard is 1.2MB
+    assert peak_bytes < df.memory_usage(deep=True).sum() / 4
@@ -1,2 +1,6 @@
 from trane.core.problem_generator import *
 from trane.core.problem import *
+from trane.core.incremental import IncrementalTargetValues
+from trane.core.sink import ParquetSink, ParquetTargetValues
+from trane.core.instrumentation import Report, profile
+from trane.core.problem_set import ProblemSet
@@ -0,0 +1,189 @@
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from trane.core.utils import (
+    WINDOW_BIN_COLUMN,
+    _calculate_target_values_vectorized,
+    _prepare_dataframe,
+)
+
+
+class IncrementalTargetValues:
+    """
+    Target values of a problem, kept up to date as new rows are appended.
+
+    Keeps the label of every (entity, window), the first timestamp of every
+    entity (which anchors its windows, see `generate_window_bins`) and the
+    rows of the last window of every entity. `update` then relabels only the
+    windows the new rows fall in and appends their labels to a log, so the
+    work is proportional to the new rows instead of the whole history. The
+    log is merged into the sorted labels when `target_values` is read. The
+    state can be saved with `save` and reloaded with
+    `IncrementalTargetValues.load`.
+
+    New rows can't fall in a window before the last window of their entity,
+    since the rows of older windows are not kept.
+    """
+
+    def __init__(self, problem, dataframes, verbose=False):
+        if problem.has_parameters_set() is False:
+            raise ValueError(
+                "Filter operation's parameters must be set to update target values",
+            )
+        self.problem = problem
+        self.verbose = verbose
+        self.target_dataframe_index = problem.entity_column or "__identity__"
+        self.window_size = pd.to_timedelta(problem.window_size).value
+
+        df = self._prepare(problem.get_normalized_dataframe(dataframes))
+        self.origins = pd.Series(dtype="int64")
+        self.last_windows = df.iloc[0:0].assign(**{WINDOW_BIN_COLUMN: 0})
+        self.labels = pd.DataFrame()
+        # labels of the updates not merged into self.labels yet
+        self.pending_labels = []
+        self._label(df)
+
+    @property
+    def target_values(self):
+        """The labels of every window, like `Problem.create_target_values`."""
+        self._merge_pending_labels()
+        lt = self.labels.drop(
+            columns=[WINDOW_BIN_COLUMN, "__identity__"],
+            errors="ignore",
+        )
+        # columns of different updates may have been concatenated as objects
+        return lt.infer_objects()
+
+    def update(self, new_rows):
+        """
+        Label the windows touched by new rows.
+
+        Args:
+            new_rows: normalized dataframe of the rows appended since the last
+                update.
+
+        Returns:
+            pd.DataFrame: the labels of the windows that changed or were added.
+        """
+        lt = self._label(self._prepare(new_rows))
+        return lt.drop(columns=[WINDOW_BIN_COLUMN, "__identity__"], errors="ignore")
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            pickle.dump(self, f)
+
+    @staticmethod
+    def load(path):
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    def _prepare(self, df):
+        if self.problem.entity_column is None:
+            # create a fake index with all rows to generate predictions problems "Predict X"
+            df = df.assign(__identity__=0)
+        return _prepare_dataframe(
+            df,
+            self.problem.metadata.time_index,
+            verbose=self.verbose,
+        )
+
+    def _window_bins(self, entities, timestamps):
+        origins = self.origins.reindex(entities.to_numpy()).to_numpy(dtype="int64")
+        return (timestamps - origins) // self.window_size
+
+    def _label(self, df):
+        entity = self.target_dataframe_index
+        df = df[df[entity].notna()]
+        if df.empty:
+            return pd.DataFrame()
+        entities = df[entity]
+        timestamps = df.index.asi8
+
+        new_entities = ~entities.isin(self.origins.index).to_numpy()
+        if new_entities.any():
+            new_origins = pd.Series(timestamps[new_entities]).groupby(
+                entities[new_entities].to_numpy(),
+            )
+            new_origins = new_origins.min()
+            if not self.origins.empty:
+                new_origins = pd.concat([self.origins, new_origins])
+            self.origins = new_origins
+        window_bins = self._window_bins(entities, timestamps)
+        last_bins = self.last_windows[WINDOW_BIN_COLUMN].groupby(
+            self.last_windows[entity].to_numpy(),
+        )
+        last_bins = last_bins.max().reindex(entities.to_numpy()).to_numpy()
+        if (window_bins < last_bins).any():
+            raise ValueError(
+                "New rows can't fall before the last window of their entity",
+            )
+
+        touched = self.last_windows[entity].isin(entities.unique()).to_numpy()
+        rows = pd.concat(
+            [
+                self.last_windows[touched],
+                df.assign(**{WINDOW_BIN_COLUMN: window_bins}),
+            ],
+        )
+        lt = _calculate_target_values_vectorized(
+            df=rows,
+            target_dataframe_index=entity,
+            labeling_function=self.problem._execute_operations_on_df,
+            window_size=self.window_size,
+            grouped_labeling_function=self.problem._execute_operations_on_groups,
+        )
+        if self.verbose:
+            print(f"relabeled {len(lt)} windows from {len(df)} new rows")
+        lt = lt.rename(columns={"_execute_operations_on_df": "target"})
+        lt[WINDOW_BIN_COLUMN] = self._window_bins(
+            lt[entity],
+            lt["cutoff_time"].to_numpy(dtype="datetime64[ns]").astype(np.int64),
+        )
+
+        self.pending_labels.append(lt)
+
+        last_bin = rows.groupby(entity, observed=True)[WINDOW_BIN_COLUMN].transform(
+            "max",
+        )
+        self.last_windows = pd.concat(
+            [
+                self.last_windows[~touched],
+                rows[rows[WINDOW_BIN_COLUMN] == last_bin],
+            ],
+        )
+        return lt
+
+    def _merge_pending_labels(self):
+        if len(self.pending_labels) == 0:
+            return
+        entity = self.target_dataframe_index
+        keys = [entity, WINDOW_BIN_COLUMN]
+        # a window relabeled by several updates keeps its latest label
+        new_labels = pd.concat(self.pending_labels, ignore_index=True)
+        new_labels = new_labels.drop_duplicates(keys, keep="last")
+        self.pending_labels = []
+        if self.labels.empty:
+            labels = new_labels
+        else:
+            # only windows of the entities in the updates can be replaced
+            replaced = self.labels[entity].isin(new_labels[entity].unique()).to_numpy()
+            replaced[replaced] = pd.MultiIndex.from_frame(
+                self.labels.loc[replaced, keys],
+            ).isin(pd.MultiIndex.from_frame(new_labels[keys]))
+            labels = pd.concat(
+                [self.labels[~replaced], new_labels],
+                ignore_index=True,
+            )
+        # the kept labels are already sorted, so the stable sort of the
+        # (entity rank, window) keys only merges the new labels in
+        entity_ranks = pd.Series(
+            np.arange(len(self.origins)),
+            index=self.origins.index.sort_values(),
+        )
+        ranks = entity_ranks.reindex(labels[entity].to_numpy()).to_numpy()
+        window_bins = labels[WINDOW_BIN_COLUMN].to_numpy(dtype="int64")
+        sort_keys = ranks * (window_bins.max() + 1) + window_bins
+        order = np.argsort(sort_keys, kind="stable")
+        self.labels = labels.take(order).reset_index(drop=True)
@@ -0,0 +1,168 @@
+import json
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+_active_reports = []
+# spans of every thread that are tracking memory and haven't ended yet
+_open_spans = set()
+# spans can run in several threads (e.g. `generate(executor=...)`)
+_lock = threading.Lock()
+
+
+class Report:
+    """
+    Timings and counters recorded while `profile` is active.
+
+    Every span name (e.g. "sort", "windowing", "label_function") keeps its
+    number of calls and total seconds. Spans can be nested, so the time of a
+    span includes the spans it contains. Counters (e.g. "windows",
+    "FilterOp.rows_in") are plain sums.
+
+    With `profile(memory=True)` every span also keeps the highest number of
+    bytes allocated above its starting point ("peak_bytes", the max over
+    calls) and the bytes still allocated when it ends ("retained_bytes",
+    summed over calls), and `frames` holds the deep size of the dataframes
+    produced by the main stages.
+    """
+
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.spans = {}
+        self.counters = {}
+        self.frames = {}
+
+    def __repr__(self):
+        return self.to_json()
+
+    def add_span(self, name, seconds):
+        span = self.spans.setdefault(name, {"calls": 0, "seconds": 0.0})
+        span["calls"] += 1
+        span["seconds"] += seconds
+
+    def add_memory(self, name, peak_bytes, retained_bytes):
+        span = self.spans[name]
+        span["peak_bytes"] = max(span.get("peak_bytes", 0), peak_bytes)
+        span["retained_bytes"] = span.get("retained_bytes", 0) + retained_bytes
+
+    def add_frame(self, name, nbytes):
+        self.frames[name] = max(self.frames.get(name, 0), nbytes)
+
+    def add_count(self, name, value):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def to_dict(self):
+        report = {
+            "spans": {name: dict(span) for name, span in self.spans.items()},
+            "counters": dict(self.counters),
+        }
+        if self.memory:
+            report["frames"] = dict(self.frames)
+        return report
+
+    def to_json(self, path=None):
+        report = json.dumps(self.to_dict(), indent=2, default=int)
+        if path is not None:
+            with open(path, "w") as f:
+                f.write(report)
+        return report
+
+
+@contextmanager
+def profile(memory=False):
+    """
+    Record where the trane calls made in the block spend their time.
+
+    Example:
+        >>> with profile(memory=True) as report:
+        ...     problem.create_target_values(df)
+        >>> report.to_json("report.json")
+
+    `memory=True` also tracks allocations with tracemalloc, which slows the
+    block down noticeably. Allocations are counted for the whole process, so
+    the memory of spans running at the same time in several threads includes
+    each other's. Work done in other processes (`n_jobs`) is not recorded.
+    """
+    report = Report(memory=memory)
+    start_tracing = memory and not tracemalloc.is_tracing()
+    if start_tracing:
+        tracemalloc.start()
+    with _lock:
+        _active_reports.append(report)
+    try:
+        yield report
+    finally:
+        with _lock:
+            _active_reports.remove(report)
+            if not _is_tracking_memory():
+                _open_spans.clear()
+        if start_tracing:
+            tracemalloc.stop()
+
+
+class span:
+    """Time the block under `name` in every active report (a no-op otherwise)."""
+
+    __slots__ = ("name", "start", "start_bytes", "nested_peak")
+
+    def __init__(self, name):
+        self.name = name
+        self.start_bytes = None
+
+    def __enter__(self):
+        if _is_tracking_memory():
+            with _lock:
+                current, peak = tracemalloc.get_traced_memory()
+                # the peak is reset, so the spans already open keep it first
+                for open_span in _open_spans:
+                    open_span.nested_peak = max(open_span.nested_peak, peak)
+                tracemalloc.reset_peak()
+                self.start_bytes, self.nested_peak = current, 0
+                _open_spans.add(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        if not _active_reports:
+            return
+        seconds = time.perf_counter() - self.start
+        with _lock:
+            for report in _active_reports:
+                report.add_span(self.name, seconds)
+            if self in _open_spans:
+                _open_spans.remove(self)
+                current, peak = tracemalloc.get_traced_memory()
+                peak = max(peak, self.nested_peak)
+                for report in _active_reports:
+                    if report.memory:
+                        report.add_memory(
+                            self.name,
+                            peak - self.start_bytes,
+                            current - self.start_bytes,
+                        )
+
+
+def count(name, value=1):
+    if _active_reports:
+        with _lock:
+            for report in _active_reports:
+                report.add_count(name, value)
+
+
+def frame_size(name, df):
+    """Record the deep size of df under `name` when tracking memory."""
+    reports = [report for report in _active_reports if report.memory]
+    if reports:
+        nbytes = int(df.memory_usage(deep=True).sum())
+        with _lock:
+            for report in reports:
+                report.add_frame(name, nbytes)
+
+
+def is_profiling():
+    return len(_active_reports) > 0
+
+
+def _is_tracking_memory():
+    return any(report.memory for report in _active_reports)
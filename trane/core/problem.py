@@ -1,14 +1,32 @@
 import humanize
+import numpy as np
 import pandas as pd
-
-from trane.core.utils import calculate_target_values
-from trane.ops.aggregation_ops import AggregationOpBase, ExistsAggregationOp
+import pyarrow as pa
+
+from trane.core.instrumentation import count, frame_size, is_profiling, span
+from trane.core.utils import (
+    ROW_POSITION_COLUMN,
+    WINDOW_BIN_COLUMN,
+    calculate_batch_target_values,
+    calculate_target_values,
+    calculate_target_values_streaming,
+)
+from trane.ops.aggregation_ops import (
+    AggregationOpBase,
+    ExistsAggregationOp,
+    MajorityAggregationOp,
+)
 from trane.ops.filter_ops import FilterOpBase
 from trane.ops.threshold_functions import (
     find_threshold_to_maximize_uncertainty,
+    find_threshold_to_maximize_uncertainty_from_sketch,
     get_k_most_frequent,
 )
-from trane.ops.transformation_ops import TransformationOpBase
+from trane.ops.transformation_ops import (
+    IdentityOp,
+    OrderByOp,
+    TransformationOpBase,
+)
 from trane.parsing.denormalize import (
     denormalize,
 )
@@ -45,15 +63,33 @@ class Problem:
 
     def __eq__(self, other):
         if isinstance(self, other.__class__):
-            if (
-                self.operations == other.operations
-                and self.metadata == other.metadata
-                and self.window_size == other.window_size
-            ):
-                return True
-            return False
+            return self.get_key() == other.get_key()
         return False
 
+    def __hash__(self):
+        return hash(self.get_key())
+
+    def get_key(self):
+        """
+        Return a hashable key identifying the problem.
+
+        The key is made of the op classes and their columns, the filter's
+        threshold, the entity column, the window size (as a Timedelta, so
+        "2d" and "48h" match) and the target table. The threshold changes
+        with `set_parameters` (and when target values are created without
+        one), so set it before putting the problem in a set or dict key.
+        """
+        window_size = None
+        if self.window_size is not None:
+            window_size = pd.to_timedelta(self.window_size)
+        return (
+            tuple((type(op).__name__, op.column_name) for op in self.operations),
+            self.operations[0].threshold,
+            self.entity_column,
+            window_size,
+            getattr(self, "target_table", None),
+        )
+
     def has_parameters_set(self):
         return self.operations[0].has_parameters_set()
 
@@ -91,24 +127,53 @@ class Problem:
             normalized_dataframe = dataframes[list(dataframes.keys())[0]]
         else:
             multi_metadata = self.metadata.original_multi_table_metadata
-            normalized_dataframe, _ = denormalize(
-                dataframes=dataframes,
-                metadata=multi_metadata,
-                target_table=self.target_table,
-            )
-            normalized_dataframe = normalized_dataframe.sort_values(
-                by=[self.metadata.time_index],
-            )
+            with span("denormalize"):
+                normalized_dataframe, _ = denormalize(
+                    dataframes=dataframes,
+                    metadata=multi_metadata,
+                    target_table=self.target_table,
+                )
+            with span("sort"):
+                normalized_dataframe = normalized_dataframe.sort_values(
+                    by=[self.metadata.time_index],
+                )
+            frame_size("denormalize", normalized_dataframe)
         return normalized_dataframe
 
-    def get_recommended_thresholds(self, dataframes, n_quantiles=10):
+    def get_recommended_thresholds(
+        self,
+        dataframes=None,
+        n_quantiles=10,
+        sketches=None,
+    ):
+        """
+        Recommend thresholds for the filter operation.
+
+        Args:
+            dataframes: the data, as accepted by `create_target_values`.
+            n_quantiles: number of quantiles to try as numeric thresholds.
+            sketches: optional dict of column name to `ColumnSketch`, to
+                recommend thresholds from instead of the data (which is then
+                not needed), e.g. when the column doesn't fit in memory.
+        """
         # not an ideal threshold function
         # TODO: Add better threshold generation
-        normalized_dataframe = self.get_normalized_dataframe(dataframes)
+        if sketches is None:
+            normalized_dataframe = self.get_normalized_dataframe(dataframes)
         thresholds = []
         for _, type_ in self.get_required_parameters().items():
-            if type_ in [int, float]:
-                filter_op = self.operations[0]
+            filter_op = self.operations[0]
+            if type_ in [int, float] and sketches is not None:
+                recommended_threshold = (
+                    find_threshold_to_maximize_uncertainty_from_sketch(
+                        sketch=sketches[filter_op.column_name],
+                        problem_type=self.get_problem_type(),
+                        filter_op=filter_op,
+                        n_quantiles=n_quantiles,
+                    )
+                )
+                thresholds.append(recommended_threshold)
+            elif type_ in [int, float]:
                 recommended_threshold = find_threshold_to_maximize_uncertainty(
                     df=normalized_dataframe,
                     column_name=filter_op.column_name,
@@ -117,6 +182,13 @@ class Problem:
                     n_quantiles=n_quantiles,
                 )
                 thresholds.append(recommended_threshold)
+            elif sketches is not None:
+                frequent_items = sketches[filter_op.column_name].frequent_items
+                if frequent_items is None:
+                    raise ValueError(
+                        "Series must be categorical, string, object or int dtype",
+                    )
+                thresholds.extend(frequent_items.most_frequent(k=3))
             else:
                 column_name = self.operations[0].column_name
                 thresholds.extend(
@@ -133,6 +205,15 @@ class Problem:
         verbose=False,
         nrows=None,
         instance_ids=None,
+        engine="slices",
+        n_jobs=1,
+        executor=None,
+        transport="pickle",
+        partitioner="hash",
+        gap=None,
+        cutoff_times=None,
+        output="pandas",
+        sink=None,
     ):
         # Won't this always be normalized?
         normalized_dataframe = self.get_normalized_dataframe(dataframes)
@@ -147,6 +228,8 @@ class Problem:
             # create a fake index with all rows to generate predictions problems "Predict X"
             normalized_dataframe["__identity__"] = 0
             target_dataframe_index = "__identity__"
+            if cutoff_times is not None:
+                cutoff_times = cutoff_times.assign(__identity__=0)
         if instance_ids and len(instance_ids) > 0:
             if verbose:
                 print("Only selecting given instance IDs")
@@ -154,6 +237,10 @@ class Problem:
                 normalized_dataframe[self.entity_column].isin(instance_ids)
             ]
 
+        # pandas output keeps the labels as they are
+        label_dtype = None
+        if output != "pandas" or sink is not None:
+            label_dtype = self.get_label_dtype(normalized_dataframe)
         lt = calculate_target_values(
             df=normalized_dataframe,
             target_dataframe_index=target_dataframe_index,
@@ -162,27 +249,179 @@ class Problem:
             window_size=self.window_size,
             verbose=verbose,
             nrows=nrows,
+            engine=engine,
+            grouped_labeling_function=self._execute_operations_on_groups,
+            n_jobs=n_jobs,
+            executor=executor,
+            transport=transport,
+            partitioner=partitioner,
+            gap=gap,
+            sliding_labeling_function=self._execute_operations_on_sliding_windows,
+            cutoff_times=cutoff_times,
+            arrow_labeling_function=self._execute_operations_on_table,
+            output=output,
+            label_dtype=label_dtype,
+            label_name="target",
+            sink=sink,
         )
         if "__identity__" in normalized_dataframe.columns:
             normalized_dataframe.drop(columns=["__identity__"], inplace=True)
+        if sink is not None:
+            return lt
+        if output == "arrow":
+            if "__identity__" in lt.column_names:
+                lt = lt.drop_columns(["__identity__"])
+            return lt
+        if "__identity__" in lt.columns:
             lt.drop(columns=["__identity__"], inplace=True)
-        lt = lt.rename(columns={"_execute_operations_on_df": "target"})
         return lt
 
+    def get_label_dtype(self, df):
+        """
+        Return the dtype of the target values, from the aggregation's output type.
+
+        Aggregations that keep their column's type (e.g. First) use the
+        column's dtype, as a nullable Arrow type when it is a numpy one, or
+        None if they don't read a column.
+        """
+        agg_op = self.operations[2]
+        _, output_type = agg_op.input_output_types[0]
+        dtype = convert_op_type(output_type).dtype
+        if dtype is not None:
+            return dtype
+        if agg_op.column_name is None:
+            return None
+        dtype = df[agg_op.column_name].dtype
+        if isinstance(agg_op, MajorityAggregationOp) and dtype not in [
+            "int64",
+            "int64[pyarrow]",
+            "float64",
+            "float64[pyarrow]",
+        ]:
+            # the majority of any other column is given as a string
+            return "string[pyarrow]"
+        if dtype == "object":
+            return "string[pyarrow]"
+        if isinstance(dtype, np.dtype):
+            return pd.ArrowDtype(pa.from_numpy_dtype(dtype))
+        return dtype
+
+    def iter_target_values(self, chunks, verbose=False):
+        """
+        Create the target values from an iterable of normalized dataframe chunks.
+
+        Yields label batches as the chunks are read, with the same columns as
+        `create_target_values`. See `calculate_target_values_streaming` for
+        how the chunks must be ordered. Thresholds can't be recommended from
+        a stream, so the filter operation's parameters must already be set.
+        """
+        if self.has_parameters_set() is False:
+            raise ValueError(
+                "Filter operation's parameters must be set to stream target values",
+            )
+        target_dataframe_index = self.entity_column
+        if self.entity_column is None:
+            # create a fake index with all rows to generate predictions problems "Predict X"
+            chunks = _add_identity_column(chunks)
+            target_dataframe_index = "__identity__"
+        for lt in calculate_target_values_streaming(
+            chunks=chunks,
+            target_dataframe_index=target_dataframe_index,
+            labeling_function=self._execute_operations_on_df,
+            time_index=self.metadata.time_index,
+            window_size=self.window_size,
+            verbose=verbose,
+            grouped_labeling_function=self._execute_operations_on_groups,
+        ):
+            if "__identity__" in lt.columns:
+                lt = lt.drop(columns=["__identity__"])
+            yield lt.rename(columns={"_execute_operations_on_df": "target"})
+
     def _execute_operations_on_df(self, df):
-        df = df.copy()
-        for operation in self.operations:
-            df = operation.label_function(df)
-        return df
+        # the filter is a row mask and only the columns the transformation and
+        # aggregation read are taken, so the dataslice is never copied whole
+        filter_op, transform_op, agg_op = self.operations
+        rows_in = len(df)
+        if type(filter_op).label_mask is FilterOpBase.label_mask:
+            # a filter that only defines label_function
+            df = filter_op.label_function(df)
+            mask = None
+        else:
+            mask = filter_op.label_mask(df)
+        if isinstance(transform_op, (IdentityOp, OrderByOp)):
+            # other transformations may read or derive any column
+            columns = [
+                column
+                for column in dict.fromkeys(
+                    [transform_op.column_name, agg_op.column_name],
+                )
+                if column is not None
+            ]
+            df = df[columns]
+        if mask is not None:
+            df = df[mask]
+        df = transform_op.label_function(df)
+        if is_profiling():
+            _count_rows(filter_op, rows_in, len(df))
+        return agg_op.label_function(df)
+
+    def _execute_operations_on_groups(self, df, by):
+        # filters and transformations are applied to the whole dataframe once,
+        # only the aggregation needs to see the individual windows
+        filter_op, transform_op, agg_op = self.operations
+        rows_in = len(df)
+        df = _filter_rows(filter_op, df)
+        df = transform_op.label_function(df)
+        if is_profiling():
+            _count_rows(filter_op, rows_in, len(df))
+        by = [df[column] for column in by]
+        return agg_op.grouped_label_function(
+            df.drop(columns=WINDOW_BIN_COLUMN),
+            by,
+        )
 
-    def is_valid(self):
-        result, _ = _check_operations_valid(
-            operations=self.operations,
-            metadata=self.metadata,
+    def _execute_operations_on_sliding_windows(self, df, window_bounds):
+        filter_op, transform_op, agg_op = self.operations
+        # a transformation could reorder rows across windows
+        if not isinstance(transform_op, IdentityOp):
+            return None
+        rows_in = len(df)
+        df = _filter_rows(filter_op, df)
+        if is_profiling():
+            _count_rows(filter_op, rows_in, len(df))
+        lo, hi = window_bounds(df)
+        labels = agg_op.sliding_label_function(
+            df.drop(columns=ROW_POSITION_COLUMN),
+            lo,
+            hi,
         )
-        if result:
-            return True
-        return False
+        return labels[hi > lo]
+
+    def _execute_operations_on_table(self, table, keys):
+        filter_op, transform_op, agg_op = self.operations
+        if not isinstance(transform_op, IdentityOp):
+            return None
+        try:
+            rows_in = len(table)
+            table = filter_op.arrow_label_function(table)
+            if table is None:
+                return None
+            if is_profiling():
+                _count_rows(filter_op, rows_in, len(table))
+            return agg_op.arrow_label_function(table, keys)
+        except (pa.ArrowNotImplementedError, pa.ArrowInvalid, pa.ArrowTypeError):
+            # e.g. a threshold Arrow can't compare to the column
+            return None
+
+    def is_valid(self):
+        signature = _operations_signature(self.operations, self.metadata.ml_types)
+        if signature not in _validity_by_signature:
+            result, _ = _check_operations_valid(
+                operations=self.operations,
+                metadata=self.metadata,
+            )
+            _validity_by_signature[signature] = result
+        return _validity_by_signature[signature]
 
     def __repr__(self) -> str:
         return self.__str__()
@@ -210,11 +449,206 @@ class Problem:
         return description
 
 
+def create_batch_target_values(
+    problems,
+    dataframes,
+    verbose=False,
+    nrows=None,
+    instance_ids=None,
+    sink=None,
+):
+    """
+    Create the target values of many problems in one pass over the data.
+
+    The data is normalized, sorted and split into windows once and shared
+    by all problems, instead of once per `Problem.create_target_values` call.
+
+    Args:
+        problems: list of problems sharing the same entity column and window size.
+        dataframes: the data, as accepted by `Problem.create_target_values`.
+        sink: optional `ParquetSink` to write the target values to instead of
+            returning them.
+
+    Returns:
+        pd.DataFrame: one row per (entity, cutoff_time) and one target column
+            per problem, named after the problem's description, or the
+            sink's handle if a sink is given.
+    """
+    if len(problems) == 0:
+        raise ValueError("At least one problem is required")
+    entity_column = problems[0].entity_column
+    window_size = pd.to_timedelta(problems[0].window_size)
+    for problem in problems:
+        if (
+            problem.entity_column != entity_column
+            or pd.to_timedelta(problem.window_size) != window_size
+        ):
+            raise ValueError(
+                "All problems must share the same entity column and window size",
+            )
+
+    normalized_dataframe = problems[0].get_normalized_dataframe(dataframes)
+    # only problems without parameters need recommended thresholds
+    unset_problems = [
+        problem for problem in problems if problem.has_parameters_set() is False
+    ]
+    if verbose:
+        for problem in unset_problems:
+            print(f"Setting the filter operation's parameters of: {problem}")
+    if len(unset_problems) > 0:
+        recommend_thresholds(unset_problems, normalized_dataframe)
+    descriptions = [str(problem) for problem in problems]
+    if len(set(descriptions)) != len(descriptions):
+        raise ValueError("Problems must be unique")
+
+    target_dataframe_index = entity_column
+    if entity_column is None:
+        # create a fake index with all rows to generate predictions problems "Predict X"
+        normalized_dataframe = normalized_dataframe.assign(__identity__=0)
+        target_dataframe_index = "__identity__"
+    if instance_ids and len(instance_ids) > 0:
+        if verbose:
+            print("Only selecting given instance IDs")
+        normalized_dataframe = normalized_dataframe[
+            normalized_dataframe[entity_column].isin(instance_ids)
+        ]
+
+    label_dtypes = None
+    if sink is not None:
+        # only a sink needs one schema for all the batches
+        label_dtypes = {
+            description: problem.get_label_dtype(normalized_dataframe)
+            for description, problem in zip(descriptions, problems)
+        }
+    lt = calculate_batch_target_values(
+        df=normalized_dataframe,
+        target_dataframe_index=target_dataframe_index,
+        labeling_functions={
+            description: problem._execute_operations_on_df
+            for description, problem in zip(descriptions, problems)
+        },
+        time_index=problems[0].metadata.time_index,
+        window_size=window_size,
+        verbose=verbose,
+        nrows=nrows,
+        grouped_labeling_functions={
+            description: problem._execute_operations_on_groups
+            for description, problem in zip(descriptions, problems)
+        },
+        sink=sink,
+        label_dtypes=label_dtypes,
+    )
+    if sink is not None:
+        return lt
+    if "__identity__" in lt.columns:
+        lt = lt.drop(columns=["__identity__"])
+    return lt
+
+
+def recommend_thresholds(problems, dataframes=None, n_quantiles=10, sketches=None):
+    """
+    Recommend thresholds for the filter operations of many problems at once.
+
+    The data is normalized once per target table, and the thresholds are
+    computed once per (target table, filter column, filter op, problem type)
+    and shared by the problems of the group. Problems whose filter operation
+    doesn't have its parameters set get the last recommended threshold, like
+    in `create_batch_target_values`.
+
+    Args:
+        problems: list of problems.
+        dataframes: the data, as accepted by `Problem.create_target_values`.
+        n_quantiles: number of quantiles to try as numeric thresholds.
+        sketches: optional dict of column name to `ColumnSketch`, to recommend
+            thresholds from instead of the data.
+
+    Returns:
+        list of the recommended thresholds of each problem (empty if its
+            filter operation takes no parameters).
+    """
+    normalized_dataframes = {}
+    recommended = {}
+    thresholds = []
+    for problem in problems:
+        if problem.get_required_parameters() is None:
+            thresholds.append([])
+            continue
+        filter_op = problem.operations[0]
+        target_table = getattr(problem, "target_table", None)
+        key = (
+            target_table,
+            filter_op.column_name,
+            type(filter_op),
+            problem.get_problem_type(),
+        )
+        if key not in recommended:
+            if sketches is None and target_table not in normalized_dataframes:
+                normalized_dataframes[target_table] = problem.get_normalized_dataframe(
+                    dataframes,
+                )
+            recommended[key] = problem.get_recommended_thresholds(
+                normalized_dataframes.get(target_table),
+                n_quantiles=n_quantiles,
+                sketches=sketches,
+            )
+        thresholds.append(list(recommended[key]))
+        if problem.has_parameters_set() is False and len(recommended[key]) > 0:
+            problem.set_parameters(recommended[key][-1])
+    return thresholds
+
+
+def _filter_rows(filter_op, df):
+    # unlike label_function, always returns a dataframe (AllFilterOp gives
+    # pd.NA for an empty one)
+    if type(filter_op).label_mask is FilterOpBase.label_mask:
+        # a filter that only defines label_function
+        return filter_op.label_function(df)
+    mask = filter_op.label_mask(df)
+    if mask is None:
+        return df
+    return df[mask]
+
+
+def _count_rows(op, rows_in, rows_out):
+    count(f"{type(op).__name__}.rows_in", rows_in)
+    count(f"{type(op).__name__}.rows_out", rows_out)
+
+
+def _add_identity_column(chunks):
+    for chunk in chunks:
+        if isinstance(chunk, (pa.Table, pa.RecordBatch)):
+            chunk = chunk.to_pandas()
+        yield chunk.assign(__identity__=0)
+
+
+def _operations_signature(operations, ml_types):
+    """
+    Everything `_check_operations_valid` depends on: the op classes and the ML
+    type and tags of the column each op applies to, along with the position
+    of the first op on the same column (whose output type the later ops see).
+    """
+    columns = [op.column_name for op in operations]
+    signature = []
+    for op, column in zip(operations, columns):
+        if column is None:
+            signature.append((type(op), None))
+            continue
+        ml_type = ml_types.get(column)
+        tags = None if ml_type is None else frozenset(ml_type.get_tags())
+        signature.append((type(op), type(ml_type), tags, columns.index(column)))
+    return tuple(signature)
+
+
+# validity of the operations by signature, shared by all problems
+_validity_by_signature = {}
+
+
 def _check_operations_valid(
     operations,
     metadata,
 ):
-    ml_types = metadata.ml_types
+    # the ops' output types are recorded in a copy, metadata is left as is
+    ml_types = dict(metadata.ml_types)
     if not isinstance(operations[0], FilterOpBase):
         raise ValueError
     if not isinstance(operations[1], TransformationOpBase):
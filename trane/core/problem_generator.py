@@ -1,7 +1,14 @@
+import copy
 import itertools
-from typing import Dict, List
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Union
 
+from tqdm import tqdm
+
+from trane.core.instrumentation import count, span
 from trane.core.problem import Problem
+from trane.core.problem_set import ProblemSet
 from trane.ops.aggregation_ops import (
     AggregationOpBase,
 )
@@ -29,7 +36,7 @@ class ProblemGenerator:
         self,
         metadata,
         window_size=None,
-        target_table: str = None,
+        target_table: Union[str, List[str]] = None,
         entity_columns: List[str] = None,
     ):
         self.metadata = metadata
@@ -37,49 +44,39 @@ class ProblemGenerator:
         self.target_table = target_table
         self.entity_columns = entity_columns
 
-    def generate(self, verbose=True):
-        # denormalize and create single metadata table
-        if self.metadata.get_metadata_type() == "single":
-            single_metadata = self.metadata
-        else:
-            if self.target_table is None:
-                raise ValueError(
-                    "target_table must be specified for multi table metadata",
-                )
-            _, single_metadata = denormalize(
-                metadata=self.metadata,
-                target_table=self.target_table,
-            )
-            single_metadata.time_index = self.metadata.time_indices[self.target_table]
-            single_metadata.original_multi_table_metadata = self.metadata
-        possible_operations = _generate_possible_operations(
-            ml_types=single_metadata.ml_types,
-            primary_key=single_metadata.primary_key,
-            time_index=single_metadata.time_index,
-        )
+    def generate(self, verbose=True, n_jobs=1, executor=None):
+        """
+        Generate all the valid problems, sorted by description.
+
+        Args:
+            verbose: show progress and a summary of the problems.
+            n_jobs: number of worker processes to validate the problems of the
+                entity columns (and target tables) with. -1 uses all CPUs.
+            executor: optional `concurrent.futures.Executor` to submit the
+                entity columns to instead of starting a process pool.
+
+        Returns:
+            list of Problem, in the same order whatever n_jobs is.
+        """
         problems = []
-        valid_entity_columns = self.entity_columns
-        if self.entity_columns is None:
-            # TODO: add logic to check entity_column
-            valid_entity_columns = get_valid_entity_columns(single_metadata)
-            # Force create with no entity column to generate problems "Predict X"
-            valid_entity_columns.append(None)
-        for entity_column in valid_entity_columns:
-            for op_col_combo in possible_operations:
-                filter_op, transform_op, agg_op = op_col_combo
-                # Note: the order of the operations matters, the filter operation must be first
-                operations = [filter_op, transform_op, agg_op]
-                problem = Problem(
-                    operations=operations,
-                    metadata=single_metadata,
-                    entity_column=entity_column,
-                    window_size=self.window_size,
+        descriptions = []
+        results = self._generate_valid_operations(verbose, n_jobs, executor)
+        for unit, valid in results:
+            _, _, possible_operations, _ = unit
+            for position, description in valid:
+                problems.append(
+                    _create_problem(
+                        unit,
+                        possible_operations[position],
+                        self.window_size,
+                    ),
                 )
-                problem.target_table = self.target_table
-                if problem.is_valid():
-                    problems.append(problem)
+                descriptions.append(description)
+        count("problems", len(problems))
         # sort by string representation
-        problems = sorted(problems, key=lambda p: str(p))
+        with span("sort"):
+            order = sorted(range(len(problems)), key=descriptions.__getitem__)
+            problems = [problems[i] for i in order]
         num_classification_problems = 0
         num_regression_problems = 0
         for problem in problems:
@@ -88,14 +85,208 @@ class ProblemGenerator:
             else:
                 num_regression_problems += 1
         if verbose:
-            print("=" * 50)
-            print(f"Generated {len(problems)} total problems")
-            print("-" * 50)
-            print(f"Classification problems: {num_classification_problems}")
-            print(f"Regression problems: {num_regression_problems}")
-            print("=" * 50)
+            _print_summary(
+                len(problems),
+                num_classification_problems,
+                num_regression_problems,
+            )
         return problems
 
+    def generate_problem_set(self, verbose=True, n_jobs=1, executor=None):
+        """
+        Generate all the valid problems as a `ProblemSet`, sorted by description.
+
+        Same as `generate`, without creating a `Problem` object per problem.
+        """
+        results = self._generate_valid_operations(verbose, n_jobs, executor)
+        problem_set = ProblemSet._from_records(
+            (
+                operations[position],
+                entity_column,
+                self.window_size,
+                metadata,
+                target_table,
+                description,
+            )
+            for (metadata, target_table, operations, entity_column), valid in results
+            for position, description in valid
+        )
+        count("problems", len(problem_set))
+        with span("sort"):
+            problem_set = problem_set.sort()
+        if verbose:
+            problem_types = problem_set.count_problem_types()
+            _print_summary(
+                len(problem_set),
+                problem_types["classification"],
+                problem_types["regression"],
+            )
+        return problem_set
+
+    def iter_problems(self, verbose=False):
+        """
+        Yield the valid problems one at a time.
+
+        The problems come in a deterministic order (by target table, entity
+        column, then operations) but, unlike `generate`, are not sorted by
+        description, so the caller can stop early or stream them without
+        holding them all.
+        """
+        for unit in tqdm(
+            self._iter_units(),
+            desc="Generating problems",
+            disable=not verbose,
+        ):
+            for _, problem in _iter_valid_problems(unit, self.window_size):
+                yield problem
+
+    def _generate_valid_operations(self, verbose, n_jobs, executor):
+        """
+        Validate the operations of every (target table, entity column).
+
+        Returns a list of ((metadata, target_table, possible_operations,
+        entity_column), [(position, description), ...]) in a fixed order.
+        """
+        units = list(self._iter_units())
+        if n_jobs == 1 and executor is None:
+            results = [
+                _validate_operations(unit, self.window_size)
+                for unit in tqdm(
+                    units,
+                    desc="Generating problems",
+                    disable=not verbose,
+                )
+            ]
+            return list(zip(units, results))
+
+        if n_jobs is None or n_jobs < 1:
+            n_jobs = os.cpu_count()
+        shutdown_executor = executor is None
+        if executor is None:
+            executor = ProcessPoolExecutor(max_workers=n_jobs)
+        try:
+            futures = [
+                executor.submit(_validate_operations, unit, self.window_size)
+                for unit in units
+            ]
+            # collected in submission order, so the result doesn't depend on timing
+            results = [
+                future.result()
+                for future in tqdm(
+                    futures,
+                    desc="Generating problems",
+                    disable=not verbose,
+                )
+            ]
+        finally:
+            if shutdown_executor:
+                executor.shutdown()
+        return list(zip(units, results))
+
+    def _iter_units(self):
+        """
+        Yield (metadata, target_table, possible_operations, entity_column) for
+        every target table and entity column, denormalizing lazily.
+        """
+        for target_table in self._get_target_tables():
+            single_metadata = self._get_single_metadata(target_table)
+            possible_operations = self._get_possible_operations(single_metadata)
+            for entity_column in self._get_entity_columns(single_metadata):
+                yield single_metadata, target_table, possible_operations, entity_column
+
+    def _get_target_tables(self):
+        if isinstance(self.target_table, (list, tuple)):
+            return list(self.target_table)
+        return [self.target_table]
+
+    def _get_single_metadata(self, target_table):
+        # denormalize and create single metadata table
+        if self.metadata.get_metadata_type() == "single":
+            return self.metadata
+        if target_table is None:
+            raise ValueError(
+                "target_table must be specified for multi table metadata",
+            )
+        with span("denormalize"):
+            _, single_metadata = denormalize(
+                metadata=self.metadata,
+                target_table=target_table,
+            )
+        single_metadata.time_index = self.metadata.time_indices[target_table]
+        single_metadata.original_multi_table_metadata = self.metadata
+        return single_metadata
+
+    def _get_possible_operations(self, single_metadata):
+        with span("enumerate_operations"):
+            possible_operations = _generate_possible_operations(
+                ml_types=single_metadata.ml_types,
+                primary_key=single_metadata.primary_key,
+                time_index=single_metadata.time_index,
+            )
+        count("operation_combinations", len(possible_operations))
+        return possible_operations
+
+    def _get_entity_columns(self, single_metadata):
+        if self.entity_columns is not None:
+            return self.entity_columns
+        # TODO: add logic to check entity_column
+        valid_entity_columns = get_valid_entity_columns(single_metadata)
+        # Force create with no entity column to generate problems "Predict X"
+        valid_entity_columns.append(None)
+        return valid_entity_columns
+
+
+def _create_problem(unit, operations, window_size):
+    metadata, target_table, _, entity_column = unit
+    problem = Problem(
+        # Note: the order of the operations matters, the filter operation must be first
+        # every problem gets its own ops, so setting a threshold only changes it
+        operations=[copy.copy(op) for op in operations],
+        metadata=metadata,
+        entity_column=entity_column,
+        window_size=window_size,
+    )
+    problem.target_table = target_table
+    return problem
+
+
+def _iter_valid_problems(unit, window_size):
+    """
+    Yield the position and problem of every valid operation of a (metadata,
+    target_table, possible_operations, entity_column) unit.
+
+    `generate` (through `_validate_operations`, possibly in worker processes)
+    and `iter_problems` both validate problems with this.
+    """
+    _, _, possible_operations, _ = unit
+    for position, operations in enumerate(possible_operations):
+        problem = _create_problem(unit, operations, window_size)
+        with span("validate"):
+            is_valid = problem.is_valid()
+        if is_valid:
+            yield position, problem
+
+
+def _validate_operations(unit, window_size):
+    """Positions and descriptions of the valid operations of a unit."""
+    return [
+        (position, str(problem))
+        for position, problem in _iter_valid_problems(unit, window_size)
+    ]
+
+
+def _print_summary(
+    num_problems,
+    num_classification_problems,
+    num_regression_problems,
+):
+    print("=" * 50)
+    print(f"Generated {num_problems} total problems")
+    print("-" * 50)
+    print(f"Classification problems: {num_classification_problems}")
+    print(f"Regression problems: {num_regression_problems}")
+    print("=" * 50)
+
 
 def get_valid_entity_columns(metadata):
     entity_columns = []
@@ -126,82 +317,69 @@ def _generate_possible_operations(
     if time_index is not None:
         valid_columns.remove(time_index)
 
-    possible_operations = []
-    column_combinations = []
-    for filter_col, transform_col, agg_col in itertools.product(
-        valid_columns,
-        valid_columns,
-        valid_columns,
-    ):
-        column_combinations.append((filter_col, transform_col, agg_col))
+    columns_by_tag = _index_columns_by_tag(ml_types, valid_columns)
+    candidate_columns = {
+        operation: _get_candidate_columns(
+            operation,
+            ml_types,
+            valid_columns,
+            columns_by_tag,
+        )
+        for operation in [
+            *aggregation_operations,
+            *transformation_operations,
+            *filter_operations,
+        ]
+    }
 
+    # problems only differ by their filter and aggregation, so every
+    # (filter, aggregation) pair gets the first transformation that applies
+    unique_operations = {}
     for agg_operation, transform_operation, filter_operation in itertools.product(
         aggregation_operations,
         transformation_operations,
         filter_operations,
     ):
-        for filter_col, transform_col, agg_col in column_combinations:
-            # not ideal, what if there is more than 1 input type in the op
-            agg_op_input_type = convert_op_type(agg_operation.input_output_types[0][0])
-            transform_op_input_type = convert_op_type(
-                transform_operation.input_output_types[0][0],
-            )
-            filter_op_input_type = convert_op_type(
-                filter_operation.input_output_types[0][0],
-            )
-            agg_instance = None
-            if (
-                len(
-                    agg_operation.restricted_tags.intersection(
-                        ml_types[agg_col].get_tags(),
-                    ),
-                )
-                > 0
-            ):
-                # if the agg operation is about to apply to a column that has restricted semantic tags
-                continue
-            elif agg_op_input_type in ["None", None, MLType, MLType()]:
-                agg_instance = agg_operation(None)
-            else:
-                agg_instance = agg_operation(agg_col)
-            transform_instance = None
-            if (
-                len(
-                    transform_operation.restricted_tags.intersection(
-                        ml_types[transform_col].get_tags(),
-                    ),
-                )
-                > 0
-            ):
-                # if the agg operation is about to apply to a column that has restricted semantic tags
-                continue
-            elif transform_op_input_type in ["None", None, MLType, MLType()]:
-                transform_instance = transform_operation(None)
-            else:
-                transform_instance = transform_operation(transform_col)
-            filter_instance = None
-            if (
-                len(
-                    filter_operation.restricted_tags.intersection(
-                        ml_types[filter_col].get_tags(),
-                    ),
+        transform_columns = candidate_columns[transform_operation]
+        if len(transform_columns) == 0:
+            continue
+        for filter_col, agg_col in itertools.product(
+            candidate_columns[filter_operation],
+            candidate_columns[agg_operation],
+        ):
+            key = (filter_operation, filter_col, agg_operation, agg_col)
+            if key not in unique_operations:
+                unique_operations[key] = (
+                    filter_operation(filter_col),
+                    transform_operation(transform_columns[0]),
+                    agg_operation(agg_col),
                 )
-                > 0
-            ):
-                # if the agg operation is about to apply to a column that has restricted semantic tags
-                continue
-            elif filter_op_input_type in ["None", None, MLType, MLType()]:
-                filter_instance = filter_operation(None)
-            else:
-                filter_instance = filter_operation(filter_col)
-            possible_operations.append(
-                (filter_instance, transform_instance, agg_instance),
-            )
-    # TODO: why are duplicate problems being generated
-    unique_instances = {}
-    for operation in possible_operations:
-        filter_instance, transform_instance, agg_instance = operation
-        if (filter_instance, agg_instance) not in unique_instances:
-            unique_instances[(filter_instance, agg_instance)] = operation
-    possible_operations = list(unique_instances.values())
-    return possible_operations
+    return list(unique_operations.values())
+
+
+def _index_columns_by_tag(ml_types, columns):
+    columns_by_tag = {}
+    for column in columns:
+        for tag in ml_types[column].get_tags():
+            columns_by_tag.setdefault(tag, set()).add(column)
+    return columns_by_tag
+
+
+def _get_candidate_columns(operation, ml_types, columns, columns_by_tag):
+    """
+    Columns the operation can be applied to, in the order of `columns`.
+
+    Operations that take any column (e.g. counting rows) are applied to None,
+    as long as one of the columns does not have a restricted tag.
+    """
+    # not ideal, what if there is more than 1 input type in the op
+    input_tags = convert_op_type(operation.input_output_types[0][0]).get_tags()
+    candidates = [
+        column
+        for column in columns
+        if len(operation.restricted_tags.intersection(ml_types[column].get_tags())) == 0
+    ]
+    if len(input_tags) == 0:
+        return [None] if candidates else []
+    tagged = set().union(*[columns_by_tag.get(tag, set()) for tag in input_tags])
+    return [column for column in candidates if column in tagged]
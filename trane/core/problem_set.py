@@ -0,0 +1,270 @@
+import numpy as np
+import pandas as pd
+
+from trane.core.problem import Problem
+from trane.ops.aggregation_ops import ExistsAggregationOp
+
+
+class ProblemSet:
+    """
+    Many problems stored column by column.
+
+    Each problem is a row of integer codes (op classes, columns, entity
+    column, window size and table) plus its filter threshold and cached
+    description, so filtering, sorting and counting work on numpy arrays.
+    `Problem` objects are only created on access (indexing or iterating),
+    and changing them does not change the set.
+
+    Example:
+        >>> problem_set = ProblemGenerator(metadata, "2d").generate_problem_set()
+        >>> sums = problem_set.filter(problem_set.aggregation_ops == "SumAggregationOp")
+        >>> sums.count_problem_types()
+        {'classification': 0, 'regression': 12}
+        >>> problem = sums[0]
+    """
+
+    _code_names = [
+        "filter_op",
+        "transform_op",
+        "agg_op",
+        "filter_column",
+        "transform_column",
+        "agg_column",
+        "entity_column",
+        "window_size",
+        "table",
+    ]
+
+    def __init__(self, vocabularies, codes, thresholds, descriptions):
+        self._vocabularies = vocabularies
+        self._codes = codes
+        self.thresholds = thresholds
+        self.descriptions = descriptions
+
+    @classmethod
+    def from_problems(cls, problems):
+        return cls._from_records(
+            (
+                problem.operations,
+                problem.entity_column,
+                problem.window_size,
+                problem.metadata,
+                getattr(problem, "target_table", None),
+                str(problem),
+            )
+            for problem in problems
+        )
+
+    @classmethod
+    def _from_records(cls, records):
+        """
+        Build a set from (operations, entity_column, window_size, metadata,
+        target_table, description) tuples.
+        """
+        encoders = {
+            "op": {},
+            "column": {},
+            "entity_column": {},
+            "window_size": {},
+        }
+        # metadata objects aren't hashable, so tables are keyed by identity
+        table_codes = {}
+        tables = []
+        codes = {name: [] for name in cls._code_names}
+        thresholds = []
+        descriptions = []
+
+        def encode(vocabulary, value):
+            return encoders[vocabulary].setdefault(value, len(encoders[vocabulary]))
+
+        for record in records:
+            operations, entity_column, window_size, metadata, table, description = (
+                record
+            )
+            for kind, op in zip(["filter", "transform", "agg"], operations):
+                codes[f"{kind}_op"].append(encode("op", type(op)))
+                codes[f"{kind}_column"].append(encode("column", op.column_name))
+            codes["entity_column"].append(encode("entity_column", entity_column))
+            codes["window_size"].append(encode("window_size", window_size))
+            if (id(metadata), table) not in table_codes:
+                table_codes[(id(metadata), table)] = len(tables)
+                tables.append((metadata, table))
+            codes["table"].append(table_codes[(id(metadata), table)])
+            thresholds.append(operations[0].threshold)
+            descriptions.append(description)
+
+        vocabularies = {
+            name: _to_object_array(list(encoder)) for name, encoder in encoders.items()
+        }
+        vocabularies["table"] = tables
+        return cls(
+            vocabularies=vocabularies,
+            codes={
+                name: np.array(values, dtype=np.int32) for name, values in codes.items()
+            },
+            thresholds=_to_object_array(thresholds),
+            descriptions=_to_object_array(descriptions),
+        )
+
+    def __len__(self):
+        return len(self.descriptions)
+
+    def __repr__(self):
+        return f"ProblemSet({len(self)} problems)"
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._get_problem(i)
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            return self._get_problem(key)
+        return self._take(np.arange(len(self))[key])
+
+    def filter(self, mask):
+        """Return the problems where the boolean mask is True."""
+        return self._take(np.flatnonzero(mask))
+
+    def sort(self):
+        """Return the problems sorted by description, like `generate` does."""
+        return self._take(np.argsort(self.descriptions, kind="stable"))
+
+    def to_list(self):
+        return list(self)
+
+    @property
+    def filter_ops(self):
+        return self._decode("filter_op", "op")
+
+    @property
+    def transform_ops(self):
+        return self._decode("transform_op", "op")
+
+    @property
+    def aggregation_ops(self):
+        return self._decode("agg_op", "op")
+
+    @property
+    def filter_columns(self):
+        return self._decode("filter_column", "column")
+
+    @property
+    def transform_columns(self):
+        return self._decode("transform_column", "column")
+
+    @property
+    def aggregation_columns(self):
+        return self._decode("agg_column", "column")
+
+    @property
+    def entity_columns(self):
+        return self._decode("entity_column", "entity_column")
+
+    @property
+    def window_sizes(self):
+        return self._decode("window_size", "window_size")
+
+    def keys(self):
+        """Return `Problem.get_key()` of every problem, without creating them."""
+        ops = self._vocabularies["op"]
+        columns = self._vocabularies["column"]
+        window_sizes = [
+            None if window_size is None else pd.to_timedelta(window_size)
+            for window_size in self._vocabularies["window_size"]
+        ]
+        return [
+            (
+                tuple(
+                    (ops[op].__name__, columns[column])
+                    for op, column in [
+                        (filter_op, filter_column),
+                        (transform_op, transform_column),
+                        (agg_op, agg_column),
+                    ]
+                ),
+                threshold,
+                self._vocabularies["entity_column"][entity_column],
+                window_sizes[window_size],
+                self._vocabularies["table"][table][1],
+            )
+            for (
+                filter_op,
+                transform_op,
+                agg_op,
+                filter_column,
+                transform_column,
+                agg_column,
+                entity_column,
+                window_size,
+                table,
+            ), threshold in zip(
+                zip(*[self._codes[name].tolist() for name in self._code_names]),
+                self.thresholds,
+            )
+        ]
+
+    def is_classification(self):
+        exists = [
+            code
+            for code, op in enumerate(self._vocabularies["op"])
+            if op is ExistsAggregationOp
+        ]
+        return np.isin(self._codes["agg_op"], exists)
+
+    def is_regression(self):
+        return ~self.is_classification()
+
+    def count_problem_types(self):
+        num_classification_problems = int(self.is_classification().sum())
+        return {
+            "classification": num_classification_problems,
+            "regression": len(self) - num_classification_problems,
+        }
+
+    def _decode(self, name, vocabulary):
+        names = _to_object_array(
+            [
+                getattr(value, "__name__", value)
+                for value in self._vocabularies[vocabulary]
+            ],
+        )
+        return names[self._codes[name]]
+
+    def _take(self, indices):
+        return ProblemSet(
+            vocabularies=self._vocabularies,
+            codes={name: codes[indices] for name, codes in self._codes.items()},
+            thresholds=self.thresholds[indices],
+            descriptions=self.descriptions[indices],
+        )
+
+    def _get_problem(self, i):
+        ops = self._vocabularies["op"]
+        columns = self._vocabularies["column"]
+        operations = [
+            ops[self._codes[f"{kind}_op"][i]](
+                columns[self._codes[f"{kind}_column"][i]],
+            )
+            for kind in ["filter", "transform", "agg"]
+        ]
+        if self.thresholds[i] is not None:
+            operations[0].set_parameters(self.thresholds[i])
+        metadata, target_table = self._vocabularies["table"][self._codes["table"][i]]
+        problem = Problem(
+            metadata=metadata,
+            operations=operations,
+            entity_column=self._vocabularies["entity_column"][
+                self._codes["entity_column"][i]
+            ],
+            window_size=self._vocabularies["window_size"][
+                self._codes["window_size"][i]
+            ],
+        )
+        problem.target_table = target_table
+        return problem
+
+
+def _to_object_array(values):
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
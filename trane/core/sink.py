@@ -0,0 +1,100 @@
+import os
+import uuid
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from trane.core.utils import partition_entities
+
+
+class ParquetSink:
+    """
+    Writes label batches to a partitioned parquet dataset as they are produced.
+
+    Pass a sink to `Problem.create_target_values` (or
+    `create_batch_target_values`) to spill the target values to disk instead
+    of returning them: the entities are labeled in batches of about
+    `batch_rows` input rows, and every batch is written and dropped before
+    the next one, so memory use does not grow with the number of windows.
+
+    Batches are partitioned (hive style) either by "entity_hash", a bucket
+    number out of `n_buckets` that keeps all windows of an entity together,
+    or by "cutoff_month" ("YYYY-MM"). Internal columns (named `__*__`) are
+    not written.
+    """
+
+    def __init__(
+        self,
+        path,
+        partitioning="entity_hash",
+        n_buckets=16,
+        batch_rows=1_000_000,
+    ):
+        if partitioning not in ["entity_hash", "cutoff_month"]:
+            raise ValueError(f"Unknown partitioning: {partitioning}")
+        self.path = path
+        self.partitioning = partitioning
+        self.n_buckets = n_buckets
+        self.batch_rows = batch_rows
+        self.num_rows = 0
+        os.makedirs(path, exist_ok=True)
+
+    def write(self, lt, entity_column):
+        if isinstance(lt, pd.DataFrame):
+            lt = pa.Table.from_pandas(lt, preserve_index=False)
+        if lt.num_rows == 0:
+            return
+        if self.partitioning == "entity_hash":
+            entities = lt[entity_column].to_pandas()
+            partition = pa.array(partition_entities(entities, self.n_buckets))
+        else:
+            partition = pc.strftime(lt["cutoff_time"], format="%Y-%m")
+        lt = lt.select(
+            [
+                name
+                for name in lt.column_names
+                if not (name.startswith("__") and name.endswith("__"))
+            ],
+        )
+        lt = lt.append_column(self.partitioning, partition)
+        pq.write_to_dataset(
+            lt,
+            root_path=self.path,
+            partition_cols=[self.partitioning],
+            basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+        )
+        self.num_rows += lt.num_rows
+
+    def target_values(self):
+        return ParquetTargetValues(self.path, self.partitioning, self.num_rows)
+
+
+class ParquetTargetValues:
+    """
+    Handle to target values written by a `ParquetSink`.
+
+    Only the location and size of the dataset are kept in memory; read it
+    back with `to_dataset` (lazily, e.g. to filter on a partition) or
+    `to_pandas`.
+    """
+
+    def __init__(self, path, partitioning, num_rows):
+        self.path = path
+        self.partitioning = partitioning
+        self.num_rows = num_rows
+
+    def __len__(self):
+        return self.num_rows
+
+    def __repr__(self):
+        return f"ParquetTargetValues({self.path!r}, {self.num_rows} rows)"
+
+    def to_dataset(self):
+        return ds.dataset(self.path, format="parquet", partitioning="hive")
+
+    def to_pandas(self):
+        table = self.to_dataset().to_table()
+        return table.drop_columns(self.partitioning).to_pandas()
@@ -0,0 +1,57 @@
+import os
+import tempfile
+
+import pyarrow as pa
+
+
+class SharedDataFrame:
+    """
+    A dataframe published once as an Arrow IPC file for worker processes.
+
+    Pickling a SharedDataFrame only sends the file path, each worker then
+    memory-maps the file with `attach`. The mapped pages are shared by every
+    process through the OS page cache, and `attach(positions)` only copies
+    the requested rows out of them, so each worker holds its own shard
+    rather than a private copy of the whole dataframe.
+
+    Use as a context manager (or call `close`) to remove the file.
+    """
+
+    def __init__(self, df, directory=None):
+        table = pa.Table.from_pandas(df, preserve_index=True)
+        fd, self.path = tempfile.mkstemp(suffix=".arrow", dir=directory)
+        os.close(fd)
+        with pa.OSFile(self.path, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        self.dtypes = df.dtypes.to_dict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def attach(self, positions=None):
+        """
+        Read the dataframe, or only the rows at `positions`, from the file.
+        """
+        with pa.memory_map(self.path) as source:
+            table = pa.ipc.open_file(source).read_all()
+            if positions is not None:
+                # take the rows while still in Arrow, so only they are copied
+                table = table.take(positions)
+            df = table.to_pandas()
+        # Arrow does not record every pandas dtype (e.g. string[pyarrow])
+        mismatched_dtypes = {
+            column: dtype
+            for column, dtype in self.dtypes.items()
+            if df[column].dtype != dtype
+        }
+        if mismatched_dtypes:
+            df = df.astype(mismatched_dtypes)
+        return df
+
+    def close(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
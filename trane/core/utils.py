@@ -1,4 +1,19 @@
+import heapq
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from tqdm import tqdm
+
+from trane.core.instrumentation import count, frame_size, span
+from trane.core.transport import SharedDataFrame
+
+WINDOW_BIN_COLUMN = "__window_bin__"
+ROW_POSITION_COLUMN = "__row_position__"
 
 
 def set_dataframe_index(df, index, verbose=False):
@@ -15,7 +30,22 @@ def generate_data_slices(df, window_size, gap, drop_empty=True, verbose=False):
     window_size = pd.to_timedelta(window_size)
     gap = pd.to_timedelta(gap)
     if window_size != gap:
-        raise NotImplementedError("window_size != gap is not supported yet")
+        # sliding windows: one window starting every gap from the first timestamp
+        df = df.sort_index(kind="stable")
+        if df.empty:
+            return
+        start_ts = df.index[0]
+        while start_ts <= df.index[-1]:
+            dataslice = df.iloc[
+                df.index.searchsorted(start_ts, side="left") : df.index.searchsorted(
+                    start_ts + window_size,
+                    side="left",
+                )
+            ]
+            if drop_empty is True and not dataslice.empty:
+                yield dataslice, {"start": start_ts, "end": dataslice.index[-1]}
+            start_ts += gap
+        return
     for start_ts, dataslice in df.resample(
         window_size,
         closed="left",
@@ -30,6 +60,33 @@ def generate_data_slices(df, window_size, gap, drop_empty=True, verbose=False):
             yield dataslice, {"start": start_ts, "end": end_ts}
 
 
+def generate_window_bins(df, target_dataframe_index, window_size):
+    """
+    Compute the window number of every row in one pass.
+
+    Mirrors the bins of `generate_data_slices` (windows are anchored at the
+    first timestamp of each entity), but works on int64 nanosecond offsets
+    for all entities at once instead of resampling each group.
+
+    Args:
+        df: dataframe indexed by its time index.
+        target_dataframe_index: the entity column.
+        window_size: size of each window (anything `pd.to_timedelta` accepts).
+
+    Returns:
+        np.ndarray: int64 window number for each row of df.
+    """
+    window_size = pd.to_timedelta(window_size).value
+    timestamps = pd.Series(df.index.asi8, index=df.index)
+    origins = timestamps.groupby(
+        df[target_dataframe_index].to_numpy(),
+        dropna=False,
+    ).transform("min")
+    return ((timestamps.to_numpy() - origins.to_numpy()) // window_size).astype(
+        np.int64,
+    )
+
+
 def calculate_target_values(
     df,
     target_dataframe_index,
@@ -39,32 +96,1148 @@ def calculate_target_values(
     drop_empty=True,
     verbose=False,
     nrows=None,
+    engine="slices",
+    grouped_labeling_function=None,
+    n_jobs=1,
+    executor=None,
+    transport="pickle",
+    partitioner="hash",
+    gap=None,
+    sliding_labeling_function=None,
+    cutoff_times=None,
+    arrow_labeling_function=None,
+    output="pandas",
+    label_dtype=None,
+    label_name=None,
+    sink=None,
 ):
-    df = set_dataframe_index(df, time_index, verbose=verbose)
-    if str(df.index.dtype) == "timestamp[ns][pyarrow]":
-        df.index = df.index.astype("datetime64[ns]")
-    if nrows and nrows > 0 and nrows < len(df):
-        if verbose:
-            print("sampling {nrows} rows")
-        df = df.sample(n=nrows)
-    records = []
-    label_name = labeling_function.__name__
-    for group_key, df_by_index in df.groupby(target_dataframe_index, observed=True):
-        # TODO: support gap
-        for dataslice, _ in generate_data_slices(
-            df=df_by_index,
+    """
+    Label every window of every entity in df.
+
+    Windows are `window_size` long and a new one starts every `gap` (by
+    default `gap` equals `window_size`) from the first timestamp of each
+    entity. The cutoff time of a window is its first timestamp, or its start
+    for sliding windows (when `gap` differs from `window_size`).
+
+    Args:
+        engine: "slices" resamples each entity and calls `labeling_function`
+            on every window. "vectorized" assigns all rows to their window at
+            once and labels the windows in a single groupby; if
+            `grouped_labeling_function` is given, it is called once with
+            (df, by) and must return the labels indexed by the window keys.
+            "arrow" keeps df in a `pyarrow.Table` (df can also be one) and
+            labels the windows with `pyarrow.Table.group_by`, returning
+            Arrow-backed columns; it only handles tumbling windows in a single
+            process and uses "vectorized" otherwise.
+        grouped_labeling_function: optional grouped counterpart of
+            `labeling_function`, only used by the "vectorized" engine.
+        n_jobs: number of worker processes to label with (-1 uses all CPUs).
+            Entities are hash-partitioned into one shard per worker.
+        executor: optional `concurrent.futures.Executor` to submit the shards
+            to instead of starting a process pool of n_jobs workers.
+        transport: how the shards reach the workers. "pickle" sends each shard
+            to its worker, "memory_map" publishes df once as a
+            `SharedDataFrame` that all the workers attach to.
+        partitioner: how rows are split between the workers. "hash" hashes
+            the entities, "balanced" uses the row count of every entity to
+            even out the shards (see `partition_entities_by_load`). The
+            expected and actual load of every shard is stored as a list of
+            records in the "shards" entry of the result's `attrs`.
+        gap: time between the starts of consecutive windows.
+        sliding_labeling_function: optional counterpart of `labeling_function`
+            for sliding windows, only used by the "vectorized" engine. It is
+            called with (df, window_bounds), where df is sorted by entity and
+            time and `window_bounds(rows)` returns the positions [lo, hi) of
+            each window in any subset of those rows. It must return the labels
+            indexed by window number, or None to fall back to
+            `labeling_function`. It is also used for `cutoff_times`.
+        cutoff_times: optional dataframe with a `target_dataframe_index` and
+            a "cutoff_time" column. Instead of generating windows, label the
+            window [cutoff_time, cutoff_time + window_size) of every row,
+            found by binary search in the sorted times of its entity. The
+            result has one row per cutoff time, in the same order, including
+            empty windows. `engine`, `gap` and the parallel options are
+            ignored.
+        arrow_labeling_function: optional counterpart of
+            `grouped_labeling_function` for the "arrow" engine, called with
+            a `pyarrow.Table` and the names of the key columns. It must
+            return a table of the keys and a "label" column, or None to fall
+            back to the "vectorized" engine.
+        output: "pandas" returns a DataFrame whose entities keep the dtype
+            of the entity column (categories for a categorical) and whose
+            label dtype is that of the labels. "columnar" returns a DataFrame with typed
+            columns: the entities as a categorical, the cutoff times as
+            datetime64 and the labels as `label_dtype`. "arrow" returns the
+            same columns as a `pyarrow.Table`.
+        label_dtype: dtype of the labels for the "columnar" and "arrow"
+            outputs (inferred if None).
+        label_name: name of the label column, `labeling_function.__name__`
+            by default.
+        sink: optional `ParquetSink`. The entities are then labeled in
+            batches, each written to the sink with the "arrow" output as soon
+            as it is done, and the sink's handle is returned instead of the
+            labels. Give a `label_dtype` so all batches share a schema. With
+            n_jobs, the same process pool labels every batch.
+    """
+    if engine not in ["slices", "vectorized", "arrow"]:
+        raise ValueError(f"Unknown engine: {engine}")
+    if transport not in ["pickle", "memory_map"]:
+        raise ValueError(f"Unknown transport: {transport}")
+    if partitioner not in ["hash", "balanced"]:
+        raise ValueError(f"Unknown partitioner: {partitioner}")
+    if output not in ["pandas", "columnar", "arrow"]:
+        raise ValueError(f"Unknown output: {output}")
+    label_name = label_name or labeling_function.__name__
+
+    def label(df, cutoff_times, nrows):
+        lt = _calculate_target_values(
+            df=df,
+            target_dataframe_index=target_dataframe_index,
+            labeling_function=labeling_function,
+            time_index=time_index,
+            window_size=window_size,
+            drop_empty=drop_empty,
+            verbose=verbose,
+            nrows=nrows,
+            engine=engine,
+            grouped_labeling_function=grouped_labeling_function,
+            n_jobs=n_jobs,
+            executor=executor,
+            transport=transport,
+            partitioner=partitioner,
+            gap=gap,
+            sliding_labeling_function=sliding_labeling_function,
+            cutoff_times=cutoff_times,
+            arrow_labeling_function=arrow_labeling_function,
+        )
+        return lt.rename(columns={labeling_function.__name__: label_name})
+
+    if sink is not None:
+        df = _prepare_dataframe(df, time_index, verbose=verbose, nrows=nrows)
+        shutdown_executor = executor is None and n_jobs != 1
+        if shutdown_executor:
+            # one pool labels all the batches
+            if n_jobs is None or n_jobs < 1:
+                n_jobs = os.cpu_count()
+            executor = ProcessPoolExecutor(max_workers=n_jobs)
+        try:
+            if cutoff_times is not None:
+                # entities without rows get the label of an empty window, as
+                # they do without a sink, so they go with the first batch
+                unseen = ~cutoff_times[target_dataframe_index].isin(
+                    df[target_dataframe_index].dropna().unique(),
+                )
+            for batch_number, batch in enumerate(
+                tqdm(
+                    _iter_entity_batches(df, target_dataframe_index, sink.batch_rows),
+                    desc="Writing batches",
+                    disable=not verbose,
+                ),
+            ):
+                batch_cutoff_times = None
+                if cutoff_times is not None:
+                    in_batch = cutoff_times[target_dataframe_index].isin(
+                        batch[target_dataframe_index].unique(),
+                    )
+                    if batch_number == 0:
+                        in_batch |= unseen
+                    batch_cutoff_times = cutoff_times[in_batch]
+                lt = label(batch, batch_cutoff_times, nrows=None)
+                sink.write(
+                    _format_target_values(
+                        lt,
+                        target_dataframe_index,
+                        {label_name: label_dtype},
+                        "arrow",
+                    ),
+                    target_dataframe_index,
+                )
+        finally:
+            if shutdown_executor:
+                executor.shutdown()
+        return sink.target_values()
+    lt = label(df, cutoff_times, nrows=nrows)
+    if output == "pandas":
+        frame_size("target_values", lt)
+        return lt
+    return _format_target_values(
+        lt,
+        target_dataframe_index,
+        {label_name: label_dtype},
+        output,
+    )
+
+
+def _iter_entity_batches(df, target_dataframe_index, batch_rows):
+    # whole entities go in a batch, so all of an entity's windows are in it
+    entity_codes, _ = pd.factorize(df[target_dataframe_index], sort=True)
+    rows_per_entity = np.bincount(entity_codes[entity_codes >= 0])
+    batch_of_entity = (np.cumsum(rows_per_entity) - rows_per_entity) // batch_rows
+    batch_of_row = np.where(entity_codes >= 0, batch_of_entity[entity_codes], -1)
+    order = np.argsort(batch_of_row, kind="stable")
+    batch_of_row = batch_of_row[order]
+    for batch in np.unique(batch_of_row[batch_of_row >= 0]):
+        start, end = np.searchsorted(batch_of_row, [batch, batch + 1])
+        yield df.iloc[order[start:end]]
+
+
+def _calculate_target_values(
+    df,
+    target_dataframe_index,
+    labeling_function,
+    time_index,
+    window_size,
+    drop_empty,
+    verbose,
+    nrows,
+    engine,
+    grouped_labeling_function,
+    n_jobs,
+    executor,
+    transport,
+    partitioner,
+    gap,
+    sliding_labeling_function,
+    cutoff_times,
+    arrow_labeling_function,
+):
+    gap = window_size if gap is None else gap
+    is_sliding = pd.to_timedelta(gap) != pd.to_timedelta(window_size)
+    if (
+        engine == "arrow"
+        and cutoff_times is None
+        and not is_sliding
+        and n_jobs == 1
+        and executor is None
+    ):
+        return _calculate_target_values_arrow(
+            df=df,
+            target_dataframe_index=target_dataframe_index,
+            labeling_function=labeling_function,
+            time_index=time_index,
+            window_size=window_size,
+            verbose=verbose,
+            nrows=nrows,
+            arrow_labeling_function=arrow_labeling_function,
+            grouped_labeling_function=grouped_labeling_function,
+        )
+    if engine == "arrow":
+        engine = "vectorized"
+    df = _prepare_dataframe(df, time_index, verbose=verbose, nrows=nrows)
+    if cutoff_times is not None:
+        return _calculate_target_values_at_cutoffs(
+            df=df,
+            target_dataframe_index=target_dataframe_index,
+            labeling_function=labeling_function,
+            window_size=window_size,
+            cutoff_times=cutoff_times,
+            sliding_labeling_function=sliding_labeling_function,
+        )
+    if n_jobs != 1 or executor is not None:
+        return _calculate_target_values_parallel(
+            df=df,
+            target_dataframe_index=target_dataframe_index,
+            n_jobs=n_jobs,
+            executor=executor,
+            transport=transport,
+            partitioner=partitioner,
+            labeling_function=labeling_function,
+            time_index=time_index,
             window_size=window_size,
-            gap=window_size,
             drop_empty=drop_empty,
             verbose=verbose,
+            engine=engine,
+            grouped_labeling_function=grouped_labeling_function,
+            gap=gap,
+            sliding_labeling_function=sliding_labeling_function,
+        )
+    if engine == "vectorized" and is_sliding:
+        return _calculate_target_values_sliding(
+            df=df,
+            target_dataframe_index=target_dataframe_index,
+            labeling_function=labeling_function,
+            window_size=window_size,
+            gap=gap,
+            sliding_labeling_function=sliding_labeling_function,
+        )
+    if engine == "vectorized":
+        return _calculate_target_values_vectorized(
+            df=df,
+            target_dataframe_index=target_dataframe_index,
+            labeling_function=labeling_function,
+            window_size=window_size,
+            grouped_labeling_function=grouped_labeling_function,
+        )
+    cutoff_times, labels = [], []
+    label_name = labeling_function.__name__
+    count("rows_in", len(df))
+    with span("groupby"):
+        groups = df.groupby(target_dataframe_index, observed=True)
+    # the windows of each entity are counted, so its key is only stored once
+    windows_per_entity = np.zeros(groups.ngroups, dtype=np.int64)
+    for group_number, (_, df_by_index) in enumerate(
+        tqdm(
+            groups,
+            total=groups.ngroups,
+            desc="Labeling entities",
+            disable=not verbose,
+        ),
+    ):
+        with span("windowing"):
+            dataslices = list(
+                generate_data_slices(
+                    df=df_by_index,
+                    window_size=window_size,
+                    gap=gap,
+                    drop_empty=drop_empty,
+                    verbose=verbose,
+                ),
+            )
+        windows_per_entity[group_number] = len(dataslices)
+        for dataslice, slice_metadata in dataslices:
+            cutoff_time = dataslice.first_valid_index()
+            if is_sliding:
+                cutoff_time = slice_metadata["start"]
+            cutoff_times.append(cutoff_time.value)
+            with span("label_function"):
+                labels.append(labeling_function(dataslice))
+    count("windows", len(labels))
+    if len(labels) == 0:
+        return pd.DataFrame.from_records([], index=None)
+    with span("record_assembly"):
+        entities = _entity_values(groups.size().index)
+        return pd.DataFrame(
+            {
+                target_dataframe_index: entities.repeat(windows_per_entity),
+                "cutoff_time": _cutoff_times_from_ns(
+                    np.array(cutoff_times, dtype=np.int64),
+                    df.index.tz,
+                ),
+                label_name: labels,
+            },
+        )
+
+
+def _format_target_values(lt, target_dataframe_index, label_dtypes, output):
+    if lt.empty:
+        lt = pd.DataFrame(
+            {
+                target_dataframe_index: pd.Series([], dtype="object"),
+                "cutoff_time": pd.Series([], dtype="datetime64[ns]"),
+                **{
+                    label_name: pd.Series([], dtype=label_dtype or "object")
+                    for label_name, label_dtype in label_dtypes.items()
+                },
+            },
+        )
+    lt = lt.astype({target_dataframe_index: "category"})
+    lt = lt.astype(
+        {
+            label_name: label_dtype
+            for label_name, label_dtype in label_dtypes.items()
+            if label_dtype is not None
+        },
+    )
+    frame_size("target_values", lt)
+    if output == "arrow":
+        return pa.Table.from_pandas(lt, preserve_index=False)
+    return lt
+
+
+def calculate_batch_target_values(
+    df,
+    target_dataframe_index,
+    labeling_functions,
+    time_index,
+    window_size,
+    verbose=False,
+    nrows=None,
+    grouped_labeling_functions=None,
+    sink=None,
+    label_dtypes=None,
+):
+    """
+    Label every window of every entity in df for many labeling functions.
+
+    The dataframe is sorted, grouped and split into windows once, then each
+    labeling function is evaluated over the same windows.
+
+    Args:
+        labeling_functions: dict of label name to labeling function.
+        grouped_labeling_functions: optional dict of label name to the grouped
+            counterpart of the labeling function (see `calculate_target_values`).
+        sink: optional `ParquetSink` to write the labels to in batches of
+            entities (see `calculate_target_values`).
+        label_dtypes: optional dict of label name to dtype, applied to the
+            batches written to the sink.
+
+    Returns:
+        pd.DataFrame: one row per window, with one column per label name, or
+            the sink's handle if a sink is given.
+    """
+    grouped_labeling_functions = grouped_labeling_functions or {}
+    df = _prepare_dataframe(df, time_index, verbose=verbose, nrows=nrows)
+    if sink is not None:
+        label_dtypes = {
+            label_name: (label_dtypes or {}).get(label_name)
+            for label_name in labeling_functions
+        }
+        for batch in tqdm(
+            _iter_entity_batches(df, target_dataframe_index, sink.batch_rows),
+            desc="Writing batches",
+            disable=not verbose,
         ):
-            record = labeling_function(dataslice)
-            records.append(
-                {
-                    target_dataframe_index: group_key,
-                    "cutoff_time": dataslice.first_valid_index(),
-                    label_name: record,
+            lt = calculate_batch_target_values(
+                df=batch,
+                target_dataframe_index=target_dataframe_index,
+                labeling_functions=labeling_functions,
+                time_index=time_index,
+                window_size=window_size,
+                verbose=verbose,
+                grouped_labeling_functions=grouped_labeling_functions,
+            )
+            sink.write(
+                _format_target_values(
+                    lt,
+                    target_dataframe_index,
+                    label_dtypes,
+                    "arrow",
+                ),
+                target_dataframe_index,
+            )
+        return sink.target_values()
+    if df.empty:
+        return pd.DataFrame.from_records([], index=None)
+    df, by, windows = _assign_windows(df, target_dataframe_index, window_size)
+    labels = {}
+    for label_name, labeling_function in labeling_functions.items():
+        if verbose:
+            print(f"calculating target values for: {label_name}")
+        labels[label_name] = _label_windows(
+            df,
+            by,
+            windows,
+            labeling_function,
+            grouped_labeling_functions.get(label_name),
+        )
+    lt = _windows_to_dataframe(target_dataframe_index, windows, labels)
+    frame_size("target_values", lt)
+    return lt
+
+
+def calculate_target_values_streaming(
+    chunks,
+    target_dataframe_index,
+    labeling_function,
+    time_index,
+    window_size,
+    verbose=False,
+    grouped_labeling_function=None,
+):
+    """
+    Label windows from an iterable of dataframe chunks, yielding label batches.
+
+    Rows must be clustered by entity across the chunks (an entity's rows are
+    contiguous in the stream) and sorted by time within each entity, as
+    when reading a table sorted by (entity, time) with `pd.read_csv(...,
+    chunksize=...)` or parquet row groups. Chunks may also be
+    `pyarrow.Table` or `pyarrow.RecordBatch` objects.
+
+    Only the last window of the last entity of a chunk can continue in the
+    next chunk, so only those rows (and the entity's first timestamp, which
+    anchors its windows) are carried over. Every other window is labeled
+    with the "vectorized" engine as soon as its chunk is read, which keeps
+    memory bounded by the chunk size.
+
+    Yields:
+        pd.DataFrame: the labels of the windows completed by each chunk.
+    """
+    window_size_ns = pd.to_timedelta(window_size).value
+    carry, carry_origin = None, None
+    for chunk in chunks:
+        if isinstance(chunk, (pa.Table, pa.RecordBatch)):
+            chunk = chunk.to_pandas()
+        chunk = _prepare_dataframe(chunk, time_index, verbose=verbose)
+        if chunk.empty:
+            continue
+        if carry is not None:
+            chunk = pd.concat([carry, chunk])
+
+        timestamps = pd.Series(chunk.index.asi8, index=chunk.index)
+        entities = chunk[target_dataframe_index]
+        origins = timestamps.groupby(entities.to_numpy(), dropna=False).transform(
+            "min",
+        )
+        origins = origins.to_numpy()
+        if carry is not None:
+            continuing = (entities == carry[target_dataframe_index].iloc[0]).to_numpy()
+            origins[continuing] = carry_origin
+        window_bins = (timestamps.to_numpy() - origins) // window_size_ns
+        chunk = chunk.assign(**{WINDOW_BIN_COLUMN: window_bins})
+
+        # the last window of the last entity may continue in the next chunk
+        last_entity = (entities == entities.iloc[-1]).to_numpy()
+        is_carried = last_entity & (window_bins == window_bins[last_entity].max())
+        carry, carry_origin = chunk[is_carried], origins[is_carried][0]
+        carry = carry.drop(columns=WINDOW_BIN_COLUMN)
+
+        lt = _calculate_target_values_vectorized(
+            df=chunk[~is_carried],
+            target_dataframe_index=target_dataframe_index,
+            labeling_function=labeling_function,
+            window_size=window_size,
+            grouped_labeling_function=grouped_labeling_function,
+        )
+        if verbose:
+            print(f"labeled {len(lt)} windows, carrying {len(carry)} rows")
+        if not lt.empty:
+            yield lt
+
+    if carry is not None:
+        lt = _calculate_target_values_vectorized(
+            df=carry.assign(
+                **{
+                    WINDOW_BIN_COLUMN: (carry.index.asi8 - carry_origin)
+                    // window_size_ns,
                 },
+            ),
+            target_dataframe_index=target_dataframe_index,
+            labeling_function=labeling_function,
+            window_size=window_size,
+            grouped_labeling_function=grouped_labeling_function,
+        )
+        if not lt.empty:
+            yield lt
+
+
+def partition_entities(entities, n_partitions):
+    """
+    Assign every row to a partition by hashing its entity.
+
+    All rows of an entity land in the same partition, and the assignment is
+    the same across runs and processes.
+
+    Args:
+        entities: pd.Series of entity values.
+        n_partitions: number of partitions.
+
+    Returns:
+        np.ndarray: partition number of each row.
+    """
+    hashes = pd.util.hash_pandas_object(entities, index=False).to_numpy()
+    return (hashes % np.uint64(n_partitions)).astype(np.int64)
+
+
+def partition_entities_by_load(entities, n_partitions, window_bins=None):
+    """
+    Assign every row to a partition so that partitions get even row counts.
+
+    Entities are placed from largest to smallest on the least loaded
+    partition. If `window_bins` is given, an entity with more rows than an
+    even share is first cut into pieces at window boundaries, so its windows
+    can go to different partitions while each window stays whole.
+
+    Args:
+        entities: pd.Series of entity values.
+        n_partitions: number of partitions.
+        window_bins: optional window number of each row
+            (see `generate_window_bins`).
+
+    Returns:
+        (np.ndarray, np.ndarray): partition number of each row, and the
+            expected number of rows of each partition.
+    """
+    units, _ = pd.factorize(entities)
+    counts = np.bincount(units[units >= 0])
+    share = max(1, int(np.ceil(len(entities) / n_partitions)))
+    if window_bins is not None and (counts > share).any():
+        rows = np.flatnonzero((units >= 0) & (counts > share)[units.clip(0)])
+        rows = rows[np.lexsort((window_bins[rows], units[rows]))]
+        heavy_units, heavy_bins = units[rows], window_bins[rows]
+        positions = np.arange(len(rows))
+        entity_starts = np.r_[True, heavy_units[1:] != heavy_units[:-1]]
+        window_starts = entity_starts | np.r_[True, heavy_bins[1:] != heavy_bins[:-1]]
+        # rows of the entity before the window each row belongs to
+        entity_start = np.maximum.accumulate(np.where(entity_starts, positions, 0))
+        window_start = np.maximum.accumulate(np.where(window_starts, positions, 0))
+        pieces = (window_start - entity_start) // share
+        piece_units, _ = pd.factorize(pd.MultiIndex.from_arrays([heavy_units, pieces]))
+        units[rows] = len(counts) + piece_units
+        counts = np.bincount(units[units >= 0])
+
+    unit_partitions = np.zeros(len(counts), dtype=np.int64)
+    expected_rows = np.zeros(n_partitions, dtype=np.int64)
+    loads = [(0, partition) for partition in range(n_partitions)]
+    for unit in np.argsort(-counts, kind="stable"):
+        load, partition = heapq.heappop(loads)
+        unit_partitions[unit] = partition
+        expected_rows[partition] += counts[unit]
+        heapq.heappush(loads, (load + counts[unit], partition))
+    # rows without an entity are never labeled, leave them in the first partition
+    partitions = np.where(units >= 0, unit_partitions[units.clip(0)], 0)
+    return partitions, expected_rows
+
+
+def _calculate_target_values_parallel(
+    df,
+    target_dataframe_index,
+    n_jobs,
+    executor,
+    transport,
+    partitioner,
+    **kwargs,
+):
+    if n_jobs is None or n_jobs < 1:
+        n_jobs = os.cpu_count()
+    window_bins = None
+    if partitioner == "balanced":
+        # entities can only be split if every shard agrees on their windows
+        if kwargs["engine"] == "vectorized" and pd.to_timedelta(
+            kwargs["gap"],
+        ) == pd.to_timedelta(kwargs["window_size"]):
+            window_bins = generate_window_bins(
+                df,
+                target_dataframe_index,
+                kwargs["window_size"],
             )
-    records = pd.DataFrame.from_records(records, index=None)
-    return records
+        partitions, expected_rows = partition_entities_by_load(
+            df[target_dataframe_index],
+            n_jobs,
+            window_bins=window_bins,
+        )
+    else:
+        partitions = partition_entities(df[target_dataframe_index], n_jobs)
+        expected_rows = np.bincount(partitions, minlength=n_jobs)
+    shards = {
+        partition: np.flatnonzero(partitions == partition)
+        for partition in range(n_jobs)
+    }
+    shards = {
+        partition: positions
+        for partition, positions in shards.items()
+        if len(positions) > 0
+    }
+
+    shared_df = None
+    shutdown_executor = executor is None
+    if executor is None:
+        executor = ProcessPoolExecutor(max_workers=n_jobs)
+    try:
+        if transport == "memory_map":
+            shared_df = SharedDataFrame(df)
+        futures = [
+            executor.submit(
+                _calculate_target_values_shard,
+                df=shared_df if shared_df is not None else df.iloc[positions],
+                positions=positions if shared_df is not None else None,
+                window_bins=window_bins[positions] if window_bins is not None else None,
+                target_dataframe_index=target_dataframe_index,
+                **kwargs,
+            )
+            for positions in shards.values()
+        ]
+        results = [future.result() for future in futures]
+    finally:
+        if shutdown_executor:
+            executor.shutdown()
+        if shared_df is not None:
+            shared_df.close()
+
+    lt = _concat_target_values(
+        [lt for lt, _ in results],
+        df[target_dataframe_index],
+        target_dataframe_index,
+    )
+    # plain records, so pandas can copy and compare the attrs of derived frames
+    lt.attrs["shards"] = [
+        {
+            "shard": int(partition),
+            "expected_rows": int(expected_rows[partition]),
+            "rows": len(positions),
+            "windows": len(shard_lt),
+            "seconds": seconds,
+        }
+        for (partition, positions), (shard_lt, seconds) in zip(
+            shards.items(),
+            results,
+        )
+    ]
+    if kwargs["verbose"]:
+        print(pd.DataFrame(lt.attrs["shards"]).to_string(index=False))
+    return lt
+
+
+def _calculate_target_values_shard(df, positions=None, window_bins=None, **kwargs):
+    start = time.perf_counter()
+    if isinstance(df, SharedDataFrame):
+        df = df.attach(positions)
+    if window_bins is not None:
+        df = df.assign(**{WINDOW_BIN_COLUMN: window_bins})
+    lt = calculate_target_values(df=df, **kwargs)
+    return lt, time.perf_counter() - start
+
+
+def _concat_target_values(results, entities, target_dataframe_index):
+    results = [lt for lt in results if not lt.empty]
+    if len(results) == 0:
+        return pd.DataFrame.from_records([], index=None)
+    lt = pd.concat(results, ignore_index=True)
+    # put the entities back in the order a single groupby would produce, an
+    # entity split between shards gets its windows back in time order
+    entity_order = pd.Index(entities.dropna().drop_duplicates().sort_values())
+    positions = entity_order.get_indexer(lt[target_dataframe_index].to_numpy())
+    lt = lt.iloc[np.lexsort((lt["cutoff_time"].to_numpy(), positions))]
+    # shards whose labels had different dtypes were concatenated as objects
+    return lt.reset_index(drop=True).infer_objects()
+
+
+def _prepare_dataframe(df, time_index, verbose=False, nrows=None):
+    with span("prepare"):
+        df = set_dataframe_index(df, time_index, verbose=verbose)
+        if str(df.index.dtype) == "timestamp[ns][pyarrow]":
+            df.index = df.index.astype("datetime64[ns]")
+        if nrows and nrows > 0 and nrows < len(df):
+            if verbose:
+                print("sampling {nrows} rows")
+            df = df.sample(n=nrows)
+    frame_size("prepare", df)
+    return df
+
+
+def _calculate_target_values_vectorized(
+    df,
+    target_dataframe_index,
+    labeling_function,
+    window_size,
+    grouped_labeling_function=None,
+):
+    if df.empty:
+        return pd.DataFrame.from_records([], index=None)
+    df, by, windows = _assign_windows(df, target_dataframe_index, window_size)
+    labels = _label_windows(
+        df,
+        by,
+        windows,
+        labeling_function,
+        grouped_labeling_function,
+    )
+    return _windows_to_dataframe(
+        target_dataframe_index,
+        windows,
+        {labeling_function.__name__: labels},
+    )
+
+
+def _assign_windows(df, target_dataframe_index, window_size):
+    count("rows_in", len(df))
+    # resample orders each slice by time, a stable sort keeps ties in place
+    with span("sort"):
+        df = df.sort_index(kind="stable")
+    with span("windowing"):
+        # rows may already be assigned to windows when an entity is split in shards
+        if WINDOW_BIN_COLUMN not in df.columns:
+            df[WINDOW_BIN_COLUMN] = generate_window_bins(
+                df,
+                target_dataframe_index,
+                window_size,
+            )
+        by = [target_dataframe_index, WINDOW_BIN_COLUMN]
+        windows = df[by].assign(cutoff_time=df.index)
+        windows = windows.groupby(by, sort=True, observed=True)["cutoff_time"].first()
+    count("windows", len(windows))
+    return df, by, windows
+
+
+def _label_windows(df, by, windows, labeling_function, grouped_labeling_function):
+    if grouped_labeling_function is None:
+        with span("groupby"):
+            groups = df.groupby(by, sort=True, observed=True)
+        with span("label_function"):
+            return [
+                labeling_function(dataslice.drop(columns=WINDOW_BIN_COLUMN))
+                for _, dataslice in groups
+            ]
+    with span("label_function"):
+        labels = grouped_labeling_function(df, by)
+    return _fill_labels(
+        labels,
+        windows.index,
+        lambda: labeling_function(df.iloc[0:0].drop(columns=WINDOW_BIN_COLUMN)),
+    )
+
+
+def _windows_to_dataframe(target_dataframe_index, windows, labels):
+    with span("record_assembly"):
+        return pd.DataFrame(
+            {
+                target_dataframe_index: _entity_values(
+                    windows.index.get_level_values(0),
+                ),
+                "cutoff_time": pd.DatetimeIndex(windows).as_unit("ns"),
+                **labels,
+            },
+        )
+
+
+def _entity_values(entities):
+    # categorical entities come out as their categories, like groupby keys
+    if isinstance(entities.dtype, pd.CategoricalDtype):
+        return entities.categories.take(entities.codes)
+    return entities
+
+
+def _cutoff_times_from_ns(cutoff_times, tz=None):
+    cutoff_times = pd.DatetimeIndex(cutoff_times.astype("datetime64[ns]"))
+    if tz is not None:
+        cutoff_times = cutoff_times.tz_localize("UTC").tz_convert(tz)
+    return cutoff_times
+
+
+def _fill_labels(labels, index, empty_label):
+    # the labels get the dtype a list of the slices' labels would: windows
+    # left without rows (e.g. filtered out) get the empty-slice label, and
+    # Arrow values are taken as Python objects
+    found = index.isin(labels.index)
+    if found.all() and not isinstance(labels.dtype, pd.ArrowDtype):
+        return _label_values(labels.reindex(index))
+    values = labels.astype(object).reindex(index).to_numpy()
+    if not found.all():
+        values[~found] = empty_label()
+    return _label_values(pd.Series(values, dtype=object))
+
+
+def _label_values(labels):
+    # labels given as Python objects get the dtype they would have in a list
+    if labels.dtype == object:
+        labels = labels.infer_objects()
+    return labels.array
+
+
+def generate_sliding_window_bounds(
+    entity_codes,
+    offsets,
+    window_entity_codes,
+    window_numbers,
+    window_size,
+    gap,
+):
+    """
+    Find the rows of every sliding window with two `searchsorted` calls.
+
+    Window k of an entity covers the offsets [k * gap, k * gap + window_size).
+    Rows are given as the integer code of their entity and their int64 offset
+    (in ns) from the first timestamp of the entity, and must be sorted by
+    entity code, then offset. Each row is keyed by its entity code and the
+    first window it can start, or end, so that the bounds of all windows of
+    all entities come from a single sorted search.
+
+    Returns:
+        (np.ndarray, np.ndarray): positions [lo, hi) of the rows of each window.
+    """
+    window_size = pd.to_timedelta(window_size).value
+    gap = pd.to_timedelta(gap).value
+    shift = window_size // gap + 2
+    max_window = max(
+        offsets.max() // gap if len(offsets) > 0 else 0,
+        window_numbers.max() if len(window_numbers) > 0 else 0,
+    )
+    stride = int(max_window) + shift + 1
+    n_entities = max(entity_codes.max(initial=0), window_entity_codes.max(initial=0))
+    if (int(n_entities) + 1) * stride >= np.iinfo(np.int64).max:
+        raise ValueError("Too many windows, use a larger gap")
+    # a row is in window k if k <= offset // gap and (offset - window_size) // gap < k
+    start_keys = entity_codes * stride + offsets // gap
+    end_keys = entity_codes * stride + (offsets - window_size) // gap + shift
+    window_keys = window_entity_codes * stride + window_numbers
+    lo = np.searchsorted(start_keys, window_keys, side="left")
+    hi = np.searchsorted(end_keys, window_keys + shift, side="left")
+    return lo, hi
+
+
+def _calculate_target_values_sliding(
+    df,
+    target_dataframe_index,
+    labeling_function,
+    window_size,
+    gap,
+    sliding_labeling_function=None,
+):
+    label_name = labeling_function.__name__
+    df, entity_codes, entities = _sort_by_entity(df, target_dataframe_index)
+    if df.empty:
+        return pd.DataFrame.from_records([], index=None)
+    with span("windowing"):
+        timestamps = df.index.asi8
+        origins = np.full(len(entities), np.iinfo(np.int64).max)
+        np.minimum.at(origins, entity_codes, timestamps)
+        offsets = timestamps - origins[entity_codes]
+
+        # every window that starts before the last row of its entity
+        gap_ns = pd.to_timedelta(gap).value
+        last_windows = np.zeros(len(entities), dtype=np.int64)
+        np.maximum.at(last_windows, entity_codes, offsets // gap_ns)
+        window_entity_codes = np.repeat(np.arange(len(entities)), last_windows + 1)
+        window_numbers = np.arange(len(window_entity_codes)) - np.repeat(
+            np.cumsum(last_windows + 1) - (last_windows + 1),
+            last_windows + 1,
+        )
+        lo, hi = generate_sliding_window_bounds(
+            entity_codes,
+            offsets,
+            window_entity_codes,
+            window_numbers,
+            window_size,
+            gap,
+        )
+        non_empty = hi > lo
+        window_entity_codes = window_entity_codes[non_empty]
+        window_numbers = window_numbers[non_empty]
+        lo, hi = lo[non_empty], hi[non_empty]
+
+    def window_bounds(positions):
+        return generate_sliding_window_bounds(
+            entity_codes[positions],
+            offsets[positions],
+            window_entity_codes,
+            window_numbers,
+            window_size,
+            gap,
+        )
+
+    labels = _label_window_bounds(
+        df,
+        lo,
+        hi,
+        window_bounds,
+        labeling_function,
+        sliding_labeling_function,
+    )
+    with span("record_assembly"):
+        cutoff_times = origins[window_entity_codes] + window_numbers * gap_ns
+        return pd.DataFrame(
+            {
+                target_dataframe_index: _entity_values(entities).take(
+                    window_entity_codes,
+                ),
+                "cutoff_time": _cutoff_times_from_ns(cutoff_times, df.index.tz),
+                label_name: labels,
+            },
+        )
+
+
+def _calculate_target_values_at_cutoffs(
+    df,
+    target_dataframe_index,
+    labeling_function,
+    window_size,
+    cutoff_times,
+    sliding_labeling_function=None,
+):
+    label_name = labeling_function.__name__
+    df, entity_codes, entities = _sort_by_entity(df, target_dataframe_index)
+    timestamps = pd.DatetimeIndex(df.index).as_unit("ns").asi8
+    cutoff_entities = cutoff_times[target_dataframe_index]
+    cutoff_codes = entities.get_indexer(cutoff_entities)
+    starts = pd.DatetimeIndex(pd.to_datetime(cutoff_times["cutoff_time"]))
+    starts = starts.as_unit("ns").asi8
+    ends = starts + pd.to_timedelta(window_size).value
+
+    def window_bounds(positions):
+        lo = search_entity_times(
+            entity_codes[positions],
+            timestamps[positions],
+            cutoff_codes,
+            starts,
+        )
+        hi = search_entity_times(
+            entity_codes[positions],
+            timestamps[positions],
+            cutoff_codes,
+            ends,
+        )
+        return lo, hi
+
+    with span("windowing"):
+        lo, hi = window_bounds(np.arange(len(df)))
+    labels = _label_window_bounds(
+        df,
+        lo,
+        hi,
+        window_bounds,
+        labeling_function,
+        sliding_labeling_function,
+    )
+    with span("record_assembly"):
+        return pd.DataFrame(
+            {
+                target_dataframe_index: _entity_values(cutoff_entities.array),
+                "cutoff_time": pd.DatetimeIndex(
+                    pd.to_datetime(cutoff_times["cutoff_time"]),
+                ).as_unit("ns"),
+                label_name: labels,
+            },
+        )
+
+
+def search_entity_times(entity_codes, timestamps, query_codes, query_timestamps):
+    """
+    Binary search the rows of many entities at once.
+
+    Rows are given as the integer code of their entity and their timestamp
+    (int64), sorted by entity code, then timestamp. Rows and queries are
+    sorted together (queries first on ties), so every query lands right after
+    the rows of its entity that come before it.
+
+    Returns:
+        np.ndarray: position of the first row of the query's entity at or
+            after the query's timestamp, or of the first row of the next
+            entity if there is none.
+    """
+    codes = np.concatenate([query_codes, entity_codes])
+    times = np.concatenate([query_timestamps, timestamps])
+    is_row = np.concatenate(
+        [
+            np.zeros(len(query_codes), dtype=bool),
+            np.ones(len(entity_codes), dtype=bool),
+        ],
+    )
+    order = np.lexsort((is_row, times, codes))
+    rows_before = np.cumsum(is_row[order])
+    positions = np.empty(len(query_codes), dtype=np.int64)
+    positions[order[~is_row[order]]] = rows_before[~is_row[order]]
+    return positions
+
+
+def _sort_by_entity(df, target_dataframe_index):
+    entity_codes, entities = pd.factorize(df[target_dataframe_index], sort=True)
+    df = df[entity_codes >= 0]
+    entity_codes = entity_codes[entity_codes >= 0]
+    count("rows_in", len(df))
+    # sort by entity, then time (stable, so ties keep their order)
+    with span("sort"):
+        order = np.lexsort((df.index.asi8, entity_codes))
+        return df.iloc[order], entity_codes[order], entities
+
+
+def _label_window_bounds(
+    df,
+    lo,
+    hi,
+    window_bounds,
+    labeling_function,
+    sliding_labeling_function=None,
+):
+    count("windows", len(lo))
+    labels = None
+    if sliding_labeling_function is not None:
+        with span("label_function"):
+            labels = sliding_labeling_function(
+                df.assign(**{ROW_POSITION_COLUMN: np.arange(len(df))}),
+                lambda rows: window_bounds(rows[ROW_POSITION_COLUMN].to_numpy()),
+            )
+    if labels is None:
+        with span("label_function"):
+            return [
+                labeling_function(df.iloc[window_lo:window_hi])
+                for window_lo, window_hi in zip(lo, hi)
+            ]
+    return _fill_labels(
+        labels,
+        pd.RangeIndex(len(lo)),
+        lambda: labeling_function(df.iloc[0:0]),
+    )
+
+
+def _calculate_target_values_arrow(
+    df,
+    target_dataframe_index,
+    labeling_function,
+    time_index,
+    window_size,
+    verbose=False,
+    nrows=None,
+    arrow_labeling_function=None,
+    grouped_labeling_function=None,
+):
+    label_name = labeling_function.__name__
+    table = _prepare_table(df, target_dataframe_index, time_index, verbose, nrows)
+    # stable, so the rows of a window keep their order
+    with span("sort"):
+        table = table.take(pc.sort_indices(table, [(time_index, "ascending")]))
+    with span("windowing"):
+        timestamps = table[time_index].cast(
+            pa.timestamp("ns", tz=table.schema.field(time_index).type.tz),
+        )
+        timestamps = timestamps.cast(pa.int64()).to_numpy()
+        entities = table[target_dataframe_index].combine_chunks()
+        entity_codes = pc.dictionary_encode(entities).indices.to_numpy()
+        origins = np.full(entity_codes.max(initial=-1) + 1, np.iinfo(np.int64).max)
+        np.minimum.at(origins, entity_codes, timestamps)
+        window_bins = (timestamps - origins[entity_codes]) // pd.to_timedelta(
+            window_size,
+        ).value
+        table = table.append_column(WINDOW_BIN_COLUMN, pa.array(window_bins))
+
+    keys = [target_dataframe_index, WINDOW_BIN_COLUMN]
+    labels = None
+    if arrow_labeling_function is not None:
+        with span("label_function"):
+            labels = arrow_labeling_function(table, keys)
+    if labels is None:
+        df = table.to_pandas(types_mapper=pd.ArrowDtype)
+        return _calculate_target_values_vectorized(
+            df=_prepare_dataframe(df, time_index),
+            target_dataframe_index=target_dataframe_index,
+            labeling_function=labeling_function,
+            window_size=window_size,
+            grouped_labeling_function=grouped_labeling_function,
+        )
+
+    count("rows_in", len(table))
+    with span("groupby"):
+        windows = table.group_by(keys, use_threads=False).aggregate(
+            [(time_index, "min")],
+        )
+        labels = labels.append_column("matched", pa.repeat(True, len(labels)))
+        windows = windows.join(labels, keys=keys, join_type="left outer")
+        windows = windows.sort_by([(key, "ascending") for key in keys])
+    count("windows", len(windows))
+    label = windows["label"]
+    # windows left without rows (e.g. filtered out) get the empty-slice label
+    missing = pc.is_null(windows["matched"])
+    if pc.any(missing).as_py():
+        empty_slice = table.schema.empty_table().drop_columns(WINDOW_BIN_COLUMN)
+        empty_label = labeling_function(
+            empty_slice.to_pandas(types_mapper=pd.ArrowDtype).set_index(time_index),
+        )
+        label = pc.if_else(missing, pa.scalar(empty_label, type=label.type), label)
+    with span("record_assembly"):
+        return pa.table(
+            {
+                target_dataframe_index: windows[target_dataframe_index],
+                "cutoff_time": windows[f"{time_index}_min"],
+                label_name: label,
+            },
+        ).to_pandas(types_mapper=pd.ArrowDtype)
+
+
+def _prepare_table(df, target_dataframe_index, time_index, verbose=False, nrows=None):
+    if isinstance(df, pd.DataFrame):
+        if df.index.name == time_index:
+            df = df.reset_index()
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    else:
+        table = df
+    if nrows and nrows > 0 and nrows < len(table):
+        if verbose:
+            print(f"sampling {nrows} rows")
+        table = table.take(np.random.choice(len(table), size=nrows, replace=False))
+    if pa.types.is_dictionary(table.schema.field(target_dataframe_index).type):
+        entities = table[target_dataframe_index]
+        table = table.set_column(
+            table.schema.get_field_index(target_dataframe_index),
+            target_dataframe_index,
+            entities.cast(entities.type.value_type),
+        )
+    table = table.filter(pc.is_valid(table[target_dataframe_index]))
+    return table.combine_chunks()
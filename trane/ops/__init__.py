@@ -2,3 +2,9 @@ from trane.ops.op_base import *
 from trane.ops.filter_ops import *
 from trane.ops.transformation_ops import *
 from trane.ops.aggregation_ops import *
+from trane.ops.sketches import (
+    ColumnSketch,
+    FrequentItemsSketch,
+    QuantileSketch,
+    sketch_columns,
+)
@@ -1,3 +1,7 @@
+import numpy as np
+import pandas as pd
+import pyarrow.compute as pc
+
 from trane.ops.op_base import OpBase
 
 
@@ -30,8 +34,38 @@ class AggregationOpBase(OpBase):
     transformation operations transform data across rows and return a new dataset with fewer rows,
     aggregation operations accumulate the dataframe into a single row.
 
+    Grouped Kernels
+    ---------------
+    `grouped_label_function` labels every group of a dataframe in one call
+    and returns a Series indexed by the group keys. Groups whose label would
+    come from an empty dataslice may be left out. The default implementation
+    calls `label_function` on each group, so operations only need to override
+    it when they can reduce all groups natively.
+
+    `sliding_label_function` labels overlapping windows given as the row
+    positions [lo, hi) of each window, and returns one label per window. The
+    labels of empty windows are not used, so they can be anything.
+
+    `arrow_label_function` does the same as `grouped_label_function` on a
+    `pyarrow.Table` grouped by key columns, and returns a table of the keys
+    and a "label" column, or None if the operation has no Arrow kernel.
     """
 
+    def grouped_label_function(self, df, by):
+        grouped = df.groupby(by, sort=True, observed=True)
+        labels = [self.label_function(dataslice) for _, dataslice in grouped]
+        return pd.Series(labels, index=grouped.size().index, dtype="object")
+
+    def sliding_label_function(self, df, lo, hi):
+        labels = [
+            self.label_function(df.iloc[window_lo:window_hi])
+            for window_lo, window_hi in zip(lo, hi)
+        ]
+        return pd.Series(labels, dtype="object")
+
+    def arrow_label_function(self, table, keys):
+        return None
+
 
 class CountAggregationOp(AggregationOpBase):
     """
@@ -51,6 +85,15 @@ class CountAggregationOp(AggregationOpBase):
     def label_function(self, dataslice):
         return len(dataslice)
 
+    def grouped_label_function(self, df, by):
+        return df.groupby(by, sort=True, observed=True).size()
+
+    def sliding_label_function(self, df, lo, hi):
+        return pd.Series(hi - lo)
+
+    def arrow_label_function(self, table, keys):
+        return _arrow_aggregate(table, keys, [], "count_all")
+
 
 class ExistsAggregationOp(AggregationOpBase):
     input_output_types = [("None", "Boolean")]
@@ -63,6 +106,20 @@ class ExistsAggregationOp(AggregationOpBase):
     def label_function(self, dataslice):
         return len(dataslice) > 0
 
+    def grouped_label_function(self, df, by):
+        return df.groupby(by, sort=True, observed=True).size() > 0
+
+    def sliding_label_function(self, df, lo, hi):
+        return pd.Series(hi > lo)
+
+    def arrow_label_function(self, table, keys):
+        counts = _arrow_aggregate(table, keys, [], "count_all")
+        return counts.set_column(
+            counts.schema.get_field_index("label"),
+            "label",
+            pc.greater(counts["label"], 0),
+        )
+
 
 class SumAggregationOp(AggregationOpBase):
     input_output_types = [("numeric", "Double")]
@@ -76,6 +133,20 @@ class SumAggregationOp(AggregationOpBase):
             return None
         return dataslice[self.column_name].sum()
 
+    def grouped_label_function(self, df, by):
+        return df.groupby(by, sort=True, observed=True)[self.column_name].sum()
+
+    def sliding_label_function(self, df, lo, hi):
+        # prefix sums: the sum of a window is the difference of two of them
+        values = _numeric_values(df[self.column_name])
+        sums = _prefix_sums(np.where(np.isnan(values), 0, values))
+        return pd.Series(sums[hi] - sums[lo])
+
+    def arrow_label_function(self, table, keys):
+        # like sum(), windows without values are 0
+        options = pc.ScalarAggregateOptions(min_count=0)
+        return _arrow_aggregate(table, keys, self.column_name, "sum", options)
+
 
 class AvgAggregationOp(AggregationOpBase):
     input_output_types = [("numeric", "Double")]
@@ -89,6 +160,23 @@ class AvgAggregationOp(AggregationOpBase):
             return None
         return dataslice[self.column_name].mean()
 
+    def grouped_label_function(self, df, by):
+        return df.groupby(by, sort=True, observed=True)[self.column_name].mean()
+
+    def sliding_label_function(self, df, lo, hi):
+        values = _numeric_values(df[self.column_name])
+        sums = _prefix_sums(np.where(np.isnan(values), 0, values))
+        counts = _prefix_sums(~np.isnan(values))
+        totals = (sums[hi] - sums[lo]).astype("float64")
+        counts = counts[hi] - counts[lo]
+        # like mean(), windows without values are NaN
+        means = np.full(len(lo), np.nan)
+        np.divide(totals, counts, out=means, where=counts > 0)
+        return pd.Series(means)
+
+    def arrow_label_function(self, table, keys):
+        return _arrow_aggregate(table, keys, self.column_name, "mean")
+
 
 class MaxAggregationOp(AggregationOpBase):
     input_output_types = [("numeric", "Double")]
@@ -102,6 +190,16 @@ class MaxAggregationOp(AggregationOpBase):
             return None
         return dataslice[self.column_name].max()
 
+    def grouped_label_function(self, df, by):
+        return df.groupby(by, sort=True, observed=True)[self.column_name].max()
+
+    def sliding_label_function(self, df, lo, hi):
+        values = _numeric_values(df[self.column_name])
+        return pd.Series(_range_reduce(np.fmax, values, lo, hi))
+
+    def arrow_label_function(self, table, keys):
+        return _arrow_aggregate(table, keys, self.column_name, "max")
+
 
 class MinAggregationOp(AggregationOpBase):
     input_output_types = [("numeric", "Double")]
@@ -115,6 +213,16 @@ class MinAggregationOp(AggregationOpBase):
             return None
         return dataslice[self.column_name].min()
 
+    def grouped_label_function(self, df, by):
+        return df.groupby(by, sort=True, observed=True)[self.column_name].min()
+
+    def sliding_label_function(self, df, lo, hi):
+        values = _numeric_values(df[self.column_name])
+        return pd.Series(_range_reduce(np.fmin, values, lo, hi))
+
+    def arrow_label_function(self, table, keys):
+        return _arrow_aggregate(table, keys, self.column_name, "min")
+
 
 class MajorityAggregationOp(AggregationOpBase):
     input_output_types = [("category", "category")]
@@ -129,12 +237,21 @@ class MajorityAggregationOp(AggregationOpBase):
         modes = dataslice[self.column_name].mode()
         if len(modes) == 0:
             return None
-        if dataslice[self.column_name].dtype in ["int64", "int64[pyarrow]"]:
-            return int(modes[0])
-        elif dataslice[self.column_name].dtype in ["float64", "float64[pyarrow]"]:
-            return float(modes[0])
-        else:
-            return str(modes[0])
+        return _convert_majority_value(modes[0], dataslice[self.column_name].dtype)
+
+    def grouped_label_function(self, df, by):
+        column = df[self.column_name]
+        counts = df.groupby([*by, column], sort=True, observed=True).size()
+        # like mode(), ties go to the smallest value: values are already sorted
+        # within each group, so a stable sort on the counts keeps them in order
+        counts = counts.sort_values(ascending=False, kind="stable")
+        counts = counts[~counts.index.droplevel(-1).duplicated()]
+        majority = counts.index.get_level_values(-1)
+        return pd.Series(
+            [_convert_majority_value(value, column.dtype) for value in majority],
+            index=counts.index.droplevel(-1),
+            dtype="object",
+        )
 
 
 class FirstAggregationOp(AggregationOpBase):
@@ -150,6 +267,18 @@ class FirstAggregationOp(AggregationOpBase):
             return None
         return dataslice[self.column_name].iloc[0]
 
+    def grouped_label_function(self, df, by):
+        is_first = df.groupby(by, observed=True).cumcount() == 0
+        return _select_rows(df, self.column_name, by, is_first.to_numpy())
+
+    def sliding_label_function(self, df, lo, hi):
+        return _take_rows(df[self.column_name], lo)
+
+    def arrow_label_function(self, table, keys):
+        # like iloc[0], a missing value is not skipped
+        options = pc.ScalarAggregateOptions(skip_nulls=False)
+        return _arrow_aggregate(table, keys, self.column_name, "first", options)
+
 
 class LastAggregationOp(AggregationOpBase):
     input_output_types = [("category", "category")]
@@ -163,3 +292,83 @@ class LastAggregationOp(AggregationOpBase):
         if len(dataslice) == 0:
             return None
         return dataslice[self.column_name].iloc[-1]
+
+    def grouped_label_function(self, df, by):
+        is_last = df.groupby(by, observed=True).cumcount(ascending=False) == 0
+        return _select_rows(df, self.column_name, by, is_last.to_numpy())
+
+    def sliding_label_function(self, df, lo, hi):
+        return _take_rows(df[self.column_name], hi - 1)
+
+    def arrow_label_function(self, table, keys):
+        options = pc.ScalarAggregateOptions(skip_nulls=False)
+        return _arrow_aggregate(table, keys, self.column_name, "last", options)
+
+
+def _convert_majority_value(value, dtype):
+    if dtype in ["int64", "int64[pyarrow]"]:
+        return int(value)
+    elif dtype in ["float64", "float64[pyarrow]"]:
+        return float(value)
+    else:
+        return str(value)
+
+
+def _select_rows(df, column_name, by, mask):
+    # one row per group, indexed the same way a groupby reduction would be
+    keys = [(key if isinstance(key, pd.Series) else df[key])[mask] for key in by]
+    index = pd.MultiIndex.from_arrays(keys)
+    if len(keys) == 1:
+        index = index.get_level_values(0)
+    return pd.Series(df[column_name][mask].to_numpy(), index=index)
+
+
+def _take_rows(column, positions):
+    if len(column) == 0:
+        return pd.Series([None] * len(positions), dtype="object")
+    # positions of empty windows may fall outside of the column
+    positions = np.clip(positions, 0, len(column) - 1)
+    return pd.Series(column.iloc[positions].to_numpy())
+
+
+def _arrow_aggregate(table, keys, target, function, options=None):
+    # without threads, so "first" and "last" see the rows in order
+    grouped = table.group_by(keys, use_threads=False).aggregate(
+        [(target, function, options)],
+    )
+    name = f"{target}_{function}" if target else function
+    return grouped.select([*keys, name]).rename_columns([*keys, "label"])
+
+
+def _numeric_values(column):
+    # integers keep their type so sums stay exact, anything else is float
+    # with missing values as NaN
+    if pd.api.types.is_integer_dtype(column.dtype) and not column.hasnans:
+        return column.to_numpy(dtype="int64")
+    return column.to_numpy(dtype="float64", na_value=np.nan)
+
+
+def _prefix_sums(values):
+    return np.concatenate([np.zeros(1, dtype=values.dtype), np.cumsum(values)])
+
+
+def _range_reduce(ufunc, values, lo, hi):
+    # sparse table: levels[j][i] reduces values[i:i + 2**j], so any window is
+    # covered by two (overlapping) entries of the level below its length
+    lengths = hi - lo
+    results = np.zeros(len(lo), dtype=values.dtype)
+    if len(values) == 0 or lengths.max(initial=0) == 0:
+        return results
+    level_of_window = np.zeros(len(lo), dtype=np.int64)
+    non_empty = lengths > 0
+    level_of_window[non_empty] = np.floor(np.log2(lengths[non_empty])).astype(np.int64)
+    level = values
+    for j in range(level_of_window.max() + 1):
+        if j > 0:
+            level = ufunc(level[: -(1 << (j - 1))], level[1 << (j - 1) :])
+        windows = non_empty & (level_of_window == j)
+        results[windows] = ufunc(
+            level[lo[windows]],
+            level[hi[windows] - (1 << j)],
+        )
+    return results
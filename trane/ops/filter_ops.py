@@ -1,4 +1,6 @@
+import numpy as np
 import pandas as pd
+import pyarrow.compute as pc
 
 from trane.ops.op_base import OpBase
 
@@ -27,6 +29,31 @@ class FilterOpBase(OpBase):
 
     restricted_ops = set()
 
+    def label_function(self, dataslice):
+        return dataslice[self.label_mask(dataslice)]
+
+    def label_mask(self, dataslice):
+        """
+        Return the rows to keep as a boolean array, or None to keep them all.
+
+        Missing values are never kept, like with boolean indexing.
+        """
+        raise NotImplementedError
+
+    def arrow_label_function(self, table):
+        """Filter a `pyarrow.Table`, or return None if it isn't supported."""
+        return None
+
+    def sorted_bounds(self, sorted_values, thresholds):
+        """
+        Return the rows kept for every threshold at once, or None if it isn't supported.
+
+        For values sorted in ascending order (without missing values), return
+        (lo, hi, inside): the rows kept with thresholds[i] are
+        sorted_values[lo[i]:hi[i]] if inside is True, else all the others.
+        """
+        return None
+
     def has_parameters_set(self):
         if self.required_parameters is None:
             return True
@@ -58,6 +85,12 @@ class AllFilterOp(FilterOpBase):
             return pd.NA
         return dataslice
 
+    def label_mask(self, dataslice):
+        return None
+
+    def arrow_label_function(self, table):
+        return table
+
 
 class EqFilterOp(FilterOpBase):
     input_output_types = [("category", "category")]
@@ -67,8 +100,16 @@ class EqFilterOp(FilterOpBase):
     def set_parameters(self, threshold: float):
         self.threshold = threshold
 
-    def label_function(self, dataslice):
-        return dataslice[dataslice[self.column_name] == self.threshold]
+    def label_mask(self, dataslice):
+        return _to_mask(dataslice[self.column_name] == self.threshold)
+
+    def arrow_label_function(self, table):
+        return table.filter(pc.equal(table[self.column_name], self.threshold))
+
+    def sorted_bounds(self, sorted_values, thresholds):
+        lo = np.searchsorted(sorted_values, thresholds, side="left")
+        hi = np.searchsorted(sorted_values, thresholds, side="right")
+        return lo, hi, True
 
 
 class NeqFilterOp(FilterOpBase):
@@ -79,8 +120,16 @@ class NeqFilterOp(FilterOpBase):
     def set_parameters(self, threshold: float):
         self.threshold = threshold
 
-    def label_function(self, dataslice):
-        return dataslice[dataslice[self.column_name] != self.threshold]
+    def label_mask(self, dataslice):
+        return _to_mask(dataslice[self.column_name] != self.threshold)
+
+    def arrow_label_function(self, table):
+        return table.filter(pc.not_equal(table[self.column_name], self.threshold))
+
+    def sorted_bounds(self, sorted_values, thresholds):
+        lo = np.searchsorted(sorted_values, thresholds, side="left")
+        hi = np.searchsorted(sorted_values, thresholds, side="right")
+        return lo, hi, False
 
 
 class GreaterFilterOp(FilterOpBase):
@@ -91,8 +140,15 @@ class GreaterFilterOp(FilterOpBase):
     def set_parameters(self, threshold: float):
         self.threshold = threshold
 
-    def label_function(self, dataslice):
-        return dataslice[dataslice[self.column_name] > self.threshold]
+    def label_mask(self, dataslice):
+        return _to_mask(dataslice[self.column_name] > self.threshold)
+
+    def arrow_label_function(self, table):
+        return table.filter(pc.greater(table[self.column_name], self.threshold))
+
+    def sorted_bounds(self, sorted_values, thresholds):
+        lo = np.searchsorted(sorted_values, thresholds, side="right")
+        return lo, np.full(len(lo), len(sorted_values)), True
 
 
 class LessFilterOp(FilterOpBase):
@@ -103,5 +159,16 @@ class LessFilterOp(FilterOpBase):
     def set_parameters(self, threshold: float):
         self.threshold = threshold
 
-    def label_function(self, dataslice):
-        return dataslice[dataslice[self.column_name] < self.threshold]
+    def label_mask(self, dataslice):
+        return _to_mask(dataslice[self.column_name] < self.threshold)
+
+    def arrow_label_function(self, table):
+        return table.filter(pc.less(table[self.column_name], self.threshold))
+
+    def sorted_bounds(self, sorted_values, thresholds):
+        hi = np.searchsorted(sorted_values, thresholds, side="left")
+        return np.zeros(len(hi), dtype=hi.dtype), hi, True
+
+
+def _to_mask(comparison):
+    return comparison.to_numpy(dtype=bool, na_value=False)
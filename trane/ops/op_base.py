@@ -1,6 +1,7 @@
+import numpy as np
 import pandas as pd
 
-from trane.ops.threshold_functions import sample_unique_values
+from trane.ops.threshold_functions import count_rows_kept, sample_unique_values
 
 
 class Meta(type):
@@ -69,6 +70,27 @@ class OpBase(object, metaclass=Meta):
         max_number_of_rows: int = 2000,
         random_state: int = None,
     ):
+        """
+        Find the threshold keeping the fraction of the rows closest to the target.
+
+        When the op filters on label_col and supports `sorted_bounds`, every
+        unique value of the whole column is tried, in one sort. Otherwise up
+        to max_num_unique_values values are tried on up to max_number_of_rows
+        sampled rows.
+        """
+        if label_col == self.column_name:
+            rows_kept = count_rows_kept(self, df[label_col])
+            if rows_kept is not None:
+                unique_vals, counts = rows_kept
+                if len(unique_vals) == 0:
+                    return 0
+                scores = np.abs(counts / len(df) - fraction_of_data_target)
+                best = np.argmin(scores)
+                # ties go to the smallest value
+                if scores[best] < 1:
+                    return unique_vals[best]
+                return 0
+
         original_threshold = self.threshold
         unique_vals = sample_unique_values(
             df[label_col],
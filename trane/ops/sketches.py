@@ -0,0 +1,204 @@
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_bool_dtype, is_float_dtype, is_numeric_dtype
+
+
+class QuantileSketch:
+    """
+    Mergeable sketch of the distribution of a numeric column.
+
+    Values are kept in levels of at most `k` sorted values, where a value at
+    level h stands for 2**h rows (a stack of compactors, as in the KLL
+    sketch). When a level is full, every other value is promoted to the next
+    level, so memory stays O(k log(n / k)) and the rank error of a quantile
+    is about 1 / k. The minimum, maximum and count are exact.
+    """
+
+    def __init__(self, k=256):
+        self.k = k
+        self.levels = []
+        self.count = 0
+        self.min = None
+        self.max = None
+        # which half to promote, alternated so compactions don't drift
+        self._offsets = []
+
+    def update(self, values):
+        """Add an array of values, missing values are ignored."""
+        values = pd.Series(values).to_numpy(dtype="float64", na_value=np.nan)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return self
+        self._add(0, values)
+        self.count += len(values)
+        self.min = values.min() if self.min is None else min(self.min, values.min())
+        self.max = values.max() if self.max is None else max(self.max, values.max())
+        self._compress()
+        return self
+
+    def merge(self, other):
+        """Add the values summarized by another sketch."""
+        for level, values in enumerate(other.levels):
+            self._add(level, values)
+        self.count += other.count
+        for bound, pick in [("min", min), ("max", max)]:
+            values = [
+                v
+                for v in [getattr(self, bound), getattr(other, bound)]
+                if v is not None
+            ]
+            setattr(self, bound, pick(values) if values else None)
+        self._compress()
+        return self
+
+    def weighted_values(self):
+        """Return the kept values, sorted, and the number of rows each stands for."""
+        if len(self.levels) == 0:
+            return np.array([]), np.array([])
+        values = np.concatenate(self.levels)
+        weights = np.concatenate(
+            [
+                np.full(len(values), 2.0**level)
+                for level, values in enumerate(self.levels)
+            ],
+        )
+        order = np.argsort(values, kind="stable")
+        return values[order], weights[order]
+
+    def quantile(self, q):
+        """Estimate the quantiles q, interpolating linearly like `pd.Series.quantile`."""
+        q = np.asarray(q, dtype="float64")
+        if self.count == 0:
+            return np.full(q.shape, np.nan)
+        values, weights = self.weighted_values()
+        # a value standing for w rows covers the ranks around its center
+        ranks = np.cumsum(weights) - (weights + 1) / 2
+        ranks = np.concatenate([[0], ranks, [self.count - 1]])
+        values = np.concatenate([[self.min], values, [self.max]])
+        return np.interp(q * (self.count - 1), ranks, values)
+
+    def _add(self, level, values):
+        while len(self.levels) <= level:
+            self.levels.append(np.array([]))
+            self._offsets.append(0)
+        self.levels[level] = np.concatenate([self.levels[level], values])
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            if len(self.levels[level]) > self.k:
+                values = np.sort(self.levels[level])
+                # an odd value out stays at this level
+                self.levels[level] = values[len(values) - len(values) % 2 :]
+                values = values[: len(values) - len(values) % 2]
+                self._add(level + 1, values[self._offsets[level] :: 2])
+                self._offsets[level] = 1 - self._offsets[level]
+            level += 1
+
+
+class FrequentItemsSketch:
+    """
+    Mergeable sketch of the most frequent values of a column (Misra-Gries).
+
+    At most `k` counters are kept. Every value with more than n / (k + 1)
+    rows is kept, and counts are underestimated by at most n / (k + 1). With
+    at most k distinct values the counts are exact.
+    """
+
+    def __init__(self, k=64):
+        self.k = k
+        self.counters = {}
+        self.count = 0
+
+    def update(self, values):
+        """Add an array of values, missing values are ignored."""
+        counts = pd.Series(values).value_counts(sort=False)
+        self.count += int(counts.sum())
+        self._add(zip(counts.index.tolist(), counts.tolist()))
+        return self
+
+    def merge(self, other):
+        """Add the values summarized by another sketch."""
+        self.count += other.count
+        self._add(other.counters.items())
+        return self
+
+    def most_frequent(self, k=3):
+        """Return the (at most) k values with the highest counts."""
+        items = sorted(self.counters.items(), key=lambda item: -item[1])
+        return [value for value, _ in items[:k]]
+
+    def _add(self, counts):
+        for value, count in counts:
+            self.counters[value] = self.counters.get(value, 0) + count
+        if len(self.counters) > self.k:
+            # take the (k + 1)-th largest count off every counter
+            cut = np.sort(np.fromiter(self.counters.values(), dtype="int64"))[
+                -(self.k + 1)
+            ]
+            self.counters = {
+                value: count - cut
+                for value, count in self.counters.items()
+                if count > cut
+            }
+
+
+class ColumnSketch:
+    """
+    Summary of one column, built chunk by chunk or per partition and merged.
+
+    Numeric columns get a `QuantileSketch` (`quantiles`), and all but float
+    columns a `FrequentItemsSketch` (`frequent_items`), which is what
+    `Problem.get_recommended_thresholds` needs to recommend thresholds
+    without the whole column.
+
+    Example:
+        >>> sketch = ColumnSketch("amount")
+        >>> for chunk in pd.read_csv("data.csv", chunksize=100_000):
+        ...     sketch.update(chunk["amount"])
+    """
+
+    def __init__(self, column_name, k=256, n_frequent_items=64):
+        self.column_name = column_name
+        self.k = k
+        self.n_frequent_items = n_frequent_items
+        self.quantiles = None
+        self.frequent_items = None
+        self.n_missing = 0
+
+    def update(self, series):
+        self.n_missing += int(series.isna().sum())
+        if is_numeric_dtype(series.dtype) and not is_bool_dtype(series.dtype):
+            if self.quantiles is None:
+                self.quantiles = QuantileSketch(self.k)
+            self.quantiles.update(series)
+        if not is_float_dtype(series.dtype):
+            if self.frequent_items is None:
+                self.frequent_items = FrequentItemsSketch(self.n_frequent_items)
+            self.frequent_items.update(series)
+        return self
+
+    def merge(self, other):
+        self.n_missing += other.n_missing
+        for name in ["quantiles", "frequent_items"]:
+            theirs = getattr(other, name)
+            if theirs is None:
+                continue
+            if getattr(self, name) is None:
+                setattr(self, name, type(theirs)(theirs.k))
+            getattr(self, name).merge(theirs)
+        return self
+
+
+def sketch_columns(chunks, column_names, **kwargs):
+    """
+    Build a `ColumnSketch` of each column from an iterable of dataframes.
+
+    Returns:
+        dict of column name to ColumnSketch.
+    """
+    sketches = {column: ColumnSketch(column, **kwargs) for column in column_names}
+    for chunk in chunks:
+        for column, sketch in sketches.items():
+            sketch.update(chunk[column])
+    return sketches
@@ -69,6 +69,225 @@ def find_threshold_to_maximize_uncertainty(
     """
     # Use quantiles as potential thresholds
     thresholds = df[column_name].quantile(np.linspace(0, 1, n_quantiles)).unique()
+    if len(thresholds) == 0:
+        return None
+    values = df[column_name].to_numpy(dtype="float64", na_value=np.nan)
+    is_missing = np.isnan(values)
+    sorted_values = np.sort(values[~is_missing])
+    bounds = filter_op.sorted_bounds(sorted_values, thresholds)
+    if bounds is None:
+        return _find_threshold_by_filtering(
+            df,
+            column_name,
+            problem_type,
+            filter_op,
+            thresholds,
+        )
+
+    missing_kept = is_missing.any() and _missing_rows_kept(
+        filter_op,
+        df[is_missing],
+        thresholds[0],
+    )
+    return _find_best_split(
+        thresholds,
+        bounds,
+        sorted_values,
+        np.ones(len(sorted_values)),
+        is_missing.sum(),
+        missing_kept,
+        problem_type,
+    )
+
+
+def find_threshold_to_maximize_uncertainty_from_sketch(
+    sketch,
+    problem_type,
+    filter_op,
+    n_quantiles=10,
+):
+    """
+    Same as `find_threshold_to_maximize_uncertainty`, from a `ColumnSketch`.
+
+    The quantiles and the uncertainty of the splits are estimated from the
+    weighted values kept by the sketch. Returns None if the filter doesn't
+    support `sorted_bounds`.
+    """
+    if sketch.quantiles is None or sketch.quantiles.count == 0:
+        return None
+    thresholds = pd.unique(sketch.quantiles.quantile(np.linspace(0, 1, n_quantiles)))
+    sorted_values, weights = sketch.quantiles.weighted_values()
+    bounds = filter_op.sorted_bounds(sorted_values, thresholds)
+    if bounds is None:
+        return None
+    missing_kept = sketch.n_missing > 0 and _missing_rows_kept(
+        filter_op,
+        pd.DataFrame({filter_op.column_name: [np.nan]}),
+        thresholds[0],
+    )
+    return _find_best_split(
+        thresholds,
+        bounds,
+        sorted_values,
+        weights,
+        sketch.n_missing,
+        missing_kept,
+        problem_type,
+    )
+
+
+def _find_best_split(
+    thresholds,
+    bounds,
+    sorted_values,
+    weights,
+    n_missing,
+    missing_kept,
+    problem_type,
+):
+    # left is the rows in sorted_values[lo:hi], right the other non-missing rows
+    lo, hi, inside = bounds
+    if problem_type == "classification":
+        left_stats, right_stats = _split_entropy_stats(sorted_values, weights, lo, hi)
+        missing_stats = _entropy_stats(np.array([n_missing]))
+        uncertainty = _entropy
+    elif problem_type == "regression":
+        left_stats, right_stats = _split_moments(sorted_values, weights, lo, hi)
+        missing_stats = (n_missing, 0, 0, 0)
+        uncertainty = _variance
+    if not inside:
+        left_stats, right_stats = right_stats, left_stats
+    if missing_kept:
+        left_stats = _add_missing(left_stats, missing_stats)
+    else:
+        right_stats = _add_missing(right_stats, missing_stats)
+
+    # Compute weighted average of uncertainties
+    current_uncertainty = (
+        left_stats[0] * uncertainty(*left_stats)
+        + right_stats[0] * uncertainty(*right_stats)
+    ) / (weights.sum() + n_missing)
+    max_uncertainty = current_uncertainty.max()
+    if max_uncertainty <= 0:
+        return None
+    # the first of the best thresholds, ignoring rounding errors
+    best = np.flatnonzero(np.isclose(current_uncertainty, max_uncertainty))[0]
+    return thresholds[best]
+
+
+def count_rows_kept(filter_op, series):
+    """
+    Count the rows of series the filter keeps with each unique value as threshold.
+
+    The values are sorted once (as factorized codes, so it works for any
+    ordered dtype) and the counts come from the filter's `sorted_bounds`.
+
+    Returns:
+        (list of thresholds, np.ndarray of counts), or None if the filter
+        doesn't support `sorted_bounds`.
+    """
+    sorted_bounds = getattr(filter_op, "sorted_bounds", None)
+    if sorted_bounds is None:
+        return None
+    codes, uniques = pd.factorize(series, sort=True)
+    sorted_codes = np.sort(codes[codes >= 0])
+    bounds = sorted_bounds(sorted_codes, np.arange(len(uniques)))
+    if bounds is None:
+        return None
+    lo, hi, inside = bounds
+    counts = hi - lo if inside else len(sorted_codes) - (hi - lo)
+    is_missing = codes < 0
+    if len(uniques) > 0 and is_missing.any():
+        missing_rows = series[is_missing].to_frame(filter_op.column_name)
+        if _missing_rows_kept(filter_op, missing_rows, uniques[0]):
+            counts = counts + is_missing.sum()
+    return uniques.tolist(), counts
+
+
+def _missing_rows_kept(filter_op, missing_rows, threshold):
+    """Whether the filter keeps missing values, which doesn't depend on the threshold."""
+    original_threshold = filter_op.threshold
+    filter_op.set_parameters(threshold=threshold)
+    missing_kept = bool(filter_op.label_mask(missing_rows.iloc[:1])[0])
+    filter_op.set_parameters(threshold=original_threshold)
+    return missing_kept
+
+
+def _split_entropy_stats(sorted_values, weights, lo, hi):
+    """
+    Row counts and sums of c * log(c) over the value counts c of the rows
+    in sorted_values[lo:hi] and of the other rows, each row counting as its weight.
+
+    Equal values are never split, so the sums are taken over whole groups.
+    """
+    rows = np.concatenate([[0], np.cumsum(weights)])
+    _, starts, counts = np.unique(sorted_values, return_index=True, return_counts=True)
+    group_stats = np.zeros(len(sorted_values) + 1)
+    if len(starts) > 0:
+        group_weights = np.add.reduceat(weights, starts)
+        group_stats[starts + counts] = group_weights * np.log(group_weights)
+    group_stats = np.cumsum(group_stats)
+    left_rows = rows[hi] - rows[lo]
+    c_log_c = group_stats[hi] - group_stats[lo]
+    return (
+        (left_rows, c_log_c),
+        (rows[-1] - left_rows, group_stats[-1] - c_log_c),
+    )
+
+
+def _entropy_stats(counts):
+    counts = counts[counts > 0]
+    return counts.sum(), (counts * np.log(counts)).sum()
+
+
+def _entropy(rows, c_log_c):
+    rows = np.asarray(rows, dtype="float64")
+    with np.errstate(divide="ignore", invalid="ignore"):
+        entropy = np.log(rows) - c_log_c / rows
+    # empty splits or a single value
+    return np.where(rows > 0, np.maximum(entropy, 0), 0)
+
+
+def _split_moments(sorted_values, weights, lo, hi):
+    """
+    Row counts, value counts, sums and sums of squares of the rows in
+    sorted_values[lo:hi] and of the other rows, each row counting as its weight.
+    """
+    rows = np.concatenate([[0], np.cumsum(weights)])
+    # centered, so the sums of squares don't lose precision
+    centered = sorted_values
+    if len(sorted_values) > 0:
+        centered = sorted_values - np.average(sorted_values, weights=weights)
+    sums = np.concatenate([[0], np.cumsum(weights * centered)])
+    squares = np.concatenate([[0], np.cumsum(weights * centered**2)])
+    left_rows = rows[hi] - rows[lo]
+    left = (left_rows, left_rows, sums[hi] - sums[lo], squares[hi] - squares[lo])
+    right = (
+        rows[-1] - left_rows,
+        rows[-1] - left_rows,
+        sums[-1] - left[2],
+        squares[-1] - left[3],
+    )
+    return left, right
+
+
+def _variance(rows, n, total, squares):
+    n = np.asarray(n, dtype="float64")
+    with np.errstate(divide="ignore", invalid="ignore"):
+        variance = (squares - total**2 / n) / (n - 1)
+    # the sample variance of less than 2 values is undefined
+    return np.where(n > 1, np.maximum(variance, 0), 0)
+
+
+def _add_missing(stats, missing_stats):
+    if len(stats) == 2:
+        # missing values count as one more value in the entropy
+        return stats[0] + missing_stats[0], stats[1] + missing_stats[1]
+    # and are left out of the variance
+    return (stats[0] + missing_stats[0], *stats[1:])
+
+
+def _find_threshold_by_filtering(df, column_name, problem_type, filter_op, thresholds):
     max_uncertainty = 0  # Starting from 0 as initial value
     best_threshold = None
     original_threshold = filter_op.threshold
@@ -41,4 +41,5 @@ class OrderByOp(TransformationOpBase):
         return self.description.format(self.column_name)
 
     def label_function(self, dataslice):
-        return dataslice.sort_values(by=self.column_name)
+        # stable, so ties keep their time order however the data is sliced
+        return dataslice.sort_values(by=self.column_name, kind="stable")